@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmarks for ``TxReadersWriterLock``.
+
+Run from the repository root::
+
+    python benchmarks/bench_txrwlock.py [--quick] [benchmark name ...]
+
+or ``make bench``. Contended scenarios are driven by a ``task.Clock`` so the lock schedule, and
+so the reported latencies, are deterministic; only the ``ops/s`` figures depend on the machine.
+'''
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+from twisted.internet import defer
+from twisted.internet import task
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+# pylint: disable=wrong-import-position
+from txrwlock import PHASE_FAIR  # noqa: E402
+from txrwlock import READER_PREFERRING  # noqa: E402
+from txrwlock import TxReadersWriterLock  # noqa: E402
+from txrwlock import WRITER_PREFERRING  # noqa: E402
+
+
+class DeferredCounter(object):
+    '''
+    Count the ``Deferred`` instances created while active.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.__origInit = None
+
+    def __enter__(self):
+        self.count = 0
+        self.__origInit = origInit = defer.Deferred.__init__
+
+        def countingInit(d, *args, **kwargs):
+            self.count += 1
+            origInit(d, *args, **kwargs)
+
+        defer.Deferred.__init__ = countingInit
+        return self
+
+    def __exit__(self, *exc):
+        defer.Deferred.__init__ = self.__origInit
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def measureCycle(cycle, numOps):
+    with DeferredCounter() as counter:
+        for _ in range(1000):
+            cycle()
+    elapsed = timeit.timeit(cycle, number=numOps)
+    return {
+        "ops/s": numOps / elapsed,
+        "deferreds/op": counter.count / 1000,
+    }
+
+
+def benchUncontendedRead(numOps=100000, releaseNow=False):
+    lock = TxReadersWriterLock()
+    release = lock.readerReleaseNow if releaseNow else lock.readerRelease
+
+    def cycle():
+        lock.readerAcquire()
+        release()
+
+    return measureCycle(cycle, numOps)
+
+
+def benchUncontendedWrite(numOps=100000, releaseNow=False):
+    lock = TxReadersWriterLock()
+    release = lock.writerReleaseNow if releaseNow else lock.writerRelease
+
+    def cycle():
+        lock.writerAcquire()
+        release()
+
+    return measureCycle(cycle, numOps)
+
+
+def benchOptimisticRead(numOps=100000, helper=False):
+    lock = TxReadersWriterLock()
+    table = {"key": "value"}
+
+    if helper:
+
+        def cycle():
+            lock.optimisticRead(table.get, "key")
+
+    else:
+
+        def cycle():
+            stamp = lock.tryOptimisticRead()
+            table.get("key")
+            lock.validate(stamp)
+
+    return measureCycle(cycle, numOps)
+
+
+def benchQueuedReadersWakeUp(numReaders=10000):
+    lock = TxReadersWriterLock()
+    lock.writerAcquire()
+    admitted = []
+    for _ in range(numReaders):
+        lock.readerAcquire().addCallback(admitted.append)
+    start = timeit.default_timer()
+    lock.writerReleaseNow()
+    elapsed = timeit.default_timer() - start
+    assert len(admitted) == numReaders
+    return {
+        "readers": numReaders,
+        "admission ms": elapsed * 1000,
+    }
+
+
+def benchWriteBurst(numWrites=10000, coalesce=False):
+    '''
+    A burst of small writes arriving while a reader holds the lock, then released.
+    '''
+    lock = TxReadersWriterLock(stats=True)
+    table = {}
+    lock.readerAcquire()
+    for i in range(numWrites):
+        if coalesce:
+            lock.submitWrite(table.__setitem__, i, i)
+        else:
+            lock.writerAcquire().addCallback(
+                lambda _, i=i: (table.__setitem__(i, i), lock.writerReleaseNow()))
+    start = timeit.default_timer()
+    lock.readerReleaseNow()
+    elapsed = timeit.default_timer() - start
+    assert len(table) == numWrites
+    return {
+        "writes/s": numWrites / elapsed,
+        "writer tenures": lock.stats.writeAcquisitions,
+    }
+
+
+def benchMemory(numLocks=10000):
+    '''
+    Memory allocated (``tracemalloc``) per idle lock and per queued waiter.
+    '''
+    import tracemalloc  # Python 3.4+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        locks = [TxReadersWriterLock() for _ in range(numLocks)]
+        idleBytes = (tracemalloc.get_traced_memory()[0] - before) / numLocks
+        lock = locks[0]
+        lock.writerAcquire()
+        before = tracemalloc.get_traced_memory()[0]
+        waiters = [lock.readerAcquire() for _ in range(numLocks)]
+        waiterBytes = (tracemalloc.get_traced_memory()[0] - before) / len(waiters)
+    finally:
+        tracemalloc.stop()
+    return {
+        "bytes/idle lock": idleBytes,
+        "bytes/queued waiter": waiterBytes,
+    }
+
+
+def benchMixed(readRatio,
+               numOps=20000,
+               interval=0.001,
+               readHold=0.002,
+               writeHold=0.0005,
+               policy=WRITER_PREFERRING):
+    '''
+    Requests arrive every ``interval`` (simulated) seconds, a ``readRatio`` share of them are
+    reads. Reports the wall-clock throughput and the simulated waiting time percentiles.
+    '''
+    clock = task.Clock()
+    lock = TxReadersWriterLock(clock=clock, policy=policy)
+    rand = random.Random(42)
+    readWaits = []
+    writeWaits = []
+
+    def request(remaining):
+        if remaining > 1:
+            clock.callLater(interval, request, remaining - 1)
+        isRead = rand.random() < readRatio
+        start = clock.seconds()
+        if isRead:
+            d = lock.readerAcquire()
+            waits, hold, release = readWaits, readHold, lock.readerReleaseNow
+        else:
+            d = lock.writerAcquire()
+            waits, hold, release = writeWaits, writeHold, lock.writerReleaseNow
+
+        def acquired(_):
+            waits.append(clock.seconds() - start)
+            clock.callLater(hold, release)
+
+        d.addCallback(acquired)
+
+    clock.callLater(0, request, numOps)
+    startTime = timeit.default_timer()
+    while clock.getDelayedCalls():
+        clock.advance(min(c.getTime() for c in clock.getDelayedCalls()) - clock.seconds())
+    elapsed = timeit.default_timer() - startTime
+    return {
+        "ops/s": numOps / elapsed,
+        "read p50 ms": percentile(readWaits, 50) * 1000,
+        "read p99 ms": percentile(readWaits, 99) * 1000,
+        "write p50 ms": percentile(writeWaits, 50) * 1000,
+        "write p99 ms": percentile(writeWaits, 99) * 1000,
+    }
+
+
+def allBenchmarks(quick):
+    scale = 10 if quick else 1
+    return [
+        ("uncontended read", benchUncontendedRead, {"numOps": 100000 // scale}),
+        ("uncontended read (now)", benchUncontendedRead,
+         {"numOps": 100000 // scale, "releaseNow": True}),
+        ("uncontended write", benchUncontendedWrite, {"numOps": 100000 // scale}),
+        ("uncontended write (now)", benchUncontendedWrite,
+         {"numOps": 100000 // scale, "releaseNow": True}),
+        ("optimistic read", benchOptimisticRead, {"numOps": 100000 // scale}),
+        ("optimistic read (helper)", benchOptimisticRead,
+         {"numOps": 100000 // scale, "helper": True}),
+        ("queued readers wake-up", benchQueuedReadersWakeUp, {"numReaders": 10000 // scale}),
+        ("write burst", benchWriteBurst, {}),
+        ("write burst (submitWrite)", benchWriteBurst, {"coalesce": True}),
+        ("memory", benchMemory, {"numLocks": 10000 // scale}),
+        ("mixed 99% reads", benchMixed, {"readRatio": 0.99, "numOps": 20000 // scale}),
+        ("mixed 90% reads", benchMixed, {"readRatio": 0.9, "numOps": 20000 // scale}),
+        ("mixed 50% reads", benchMixed, {"readRatio": 0.5, "numOps": 20000 // scale}),
+        ("mixed 90% reads (reader-pref)", benchMixed,
+         {"readRatio": 0.9, "numOps": 20000 // scale, "readHold": 0.005,
+          "policy": READER_PREFERRING}),
+        ("mixed 90% reads (phase-fair)", benchMixed,
+         {"readRatio": 0.9, "numOps": 20000 // scale, "readHold": 0.005, "policy": PHASE_FAIR}),
+        ("mixed 90% reads (writer-pref)", benchMixed,
+         {"readRatio": 0.9, "numOps": 20000 // scale, "readHold": 0.005,
+          "policy": WRITER_PREFERRING}),
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TxReadersWriterLock benchmarks")
+    parser.add_argument("--quick", action="store_true", help="run 10 times less operations")
+    parser.add_argument("names", nargs="*", help="only run the benchmarks containing these names")
+    args = parser.parse_args(argv)
+    for name, bench, kwargs in allBenchmarks(args.quick):
+        if args.names and not any(n in name for n in args.names):
+            continue
+        results = bench(**kwargs)
+        print("{0:<30} {1}".format(
+            name, "  ".join("{0}={1:.1f}".format(k, v) for k, v in sorted(results.items()))))
+
+
+if __name__ == "__main__":
+    main()
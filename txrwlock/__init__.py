@@ -3,7 +3,46 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import sys
+
+from .keyed import READ
+from .keyed import WRITE
+from .keyed import KeyedReadersWriterLock
+from .remote import LockClientProtocol
+from .rcu import SharedValue
+from .remote import LockServerFactory
+from .stats import LockStats
+from .threaded import BlockingReadersWriterLock
+from .txrwlock import LockQueueFullError
+from .txrwlock import PHASE_FAIR
+from .txrwlock import READER_PREFERRING
 from .txrwlock import TxReadersWriterLock
+from .txrwlock import WRITER_PREFERRING
 from .txtestcase import TxTestCase
 
-__all__ = ['TxTestCase', 'TxReadersWriterLock']
+__all__ = [
+    'BlockingReadersWriterLock',
+    'KeyedReadersWriterLock',
+    'LockClientProtocol',
+    'LockQueueFullError',
+    'LockServerFactory',
+    'LockStats',
+    'PHASE_FAIR',
+    'READ',
+    'READER_PREFERRING',
+    'SharedValue',
+    'TxReadersWriterLock',
+    'TxTestCase',
+    'WRITE',
+    'WRITER_PREFERRING',
+]
+
+try:
+    from .filelock import FileReadersWriterLock  # noqa: F401
+    __all__.append('FileReadersWriterLock')
+except ImportError:  # No fcntl (Windows)
+    pass
+
+if sys.version_info >= (3, 5):
+    from .aiorwlock import AsyncReadersWriterLock  # noqa: F401
+    __all__.append('AsyncReadersWriterLock')
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# asyncio implementation of the Readers/Writer Lock
+# License:
+#   MIT License
+#
+# This module requires Python 3.5 or newer (``async def`` syntax).
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import asyncio
+import time
+
+from . import debug as _debug
+from .stats import LockStats
+from .base import WRITER_PREFERRING
+from .base import _ReadersWriterLockBase
+
+__all__ = ["AsyncReadersWriterLock"]
+
+try:
+    _getRunningLoop = asyncio.get_running_loop  # Python 3.7+
+except AttributeError:
+    _getRunningLoop = asyncio.get_event_loop
+
+
+class _AsyncSection(object):
+    '''
+    Asynchronous context manager holding one side of an ``AsyncReadersWriterLock``.
+    '''
+
+    __slots__ = ('__acquire', '__release')
+
+    def __init__(self, acquire, release):
+        self.__acquire = acquire
+        self.__release = release
+
+    def __call__(self):
+        # Allows ``async with lock.reader():``, like ``TxReadersWriterLock``
+        return self
+
+    async def __aenter__(self):
+        await self.__acquire()
+
+    async def __aexit__(self, excType, excValue, traceback):
+        self.__release()
+
+
+class AsyncReadersWriterLock(_ReadersWriterLockBase):
+    '''
+    Readers-Writer Lock for asyncio coroutines
+
+    Same semantics as ``TxReadersWriterLock`` (many simultaneous readers, exclusive writer, writers
+    have priority over new readers unless another ``policy`` is given), but the waiters are
+    ``asyncio.Future`` objects, so it can be awaited from native coroutines without going through
+    ``Deferred``.
+
+    It must only be used from the thread running its event loop.
+
+    **Usage**
+
+    .. code-block:: python
+
+        from txrwlock import AsyncReadersWriterLock
+
+        rwlocker = AsyncReadersWriterLock()
+
+        async def aReaderMethod(...):
+            async with rwlocker.reader:
+                # ... any treatment ...
+
+        async def aWriterMethod(...):
+            async with rwlocker.writer:
+                # ... any treatment ...
+
+    ``readerAcquire``/``writerAcquire`` are coroutines, ``readerRelease``/``writerRelease`` are
+    plain synchronous methods, like ``asyncio.Lock``.
+
+    With ``stats=True``, the ``stats`` property gives a ``LockStats`` measured with the event loop
+    clock. ``maxQueuedReaders``, ``maxQueuedWriters`` and ``onSaturated`` bound the waiting queues
+    like for ``TxReadersWriterLock``: the acquisition coroutines then raise ``LockQueueFullError``.
+    ``debug`` works like for ``TxReadersWriterLock`` too.
+    '''
+
+    __slots__ = ('__loop', 'reader', 'writer')
+
+    # All the options have a default value, and are meant to be passed by keyword
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 loop=None,
+                 stats=False,
+                 policy=WRITER_PREFERRING,
+                 maxQueuedReaders=None,
+                 maxQueuedWriters=None,
+                 onSaturated=None,
+                 debug=None):
+        if debug is None:
+            debug = _debug.isEnabled()
+        if debug:
+            stats = _debug.DebugLockStats(self.__time, self)
+        else:
+            stats = LockStats(self.__time) if stats else None
+        super(AsyncReadersWriterLock, self).__init__(
+            stats=stats,
+            policy=policy,
+            maxQueuedReaders=maxQueuedReaders,
+            maxQueuedWriters=maxQueuedWriters,
+            onSaturated=onSaturated)
+        self.__loop = loop
+        self.reader = _AsyncSection(self.readerAcquire, self.readerRelease)
+        self.writer = _AsyncSection(self.writerAcquire, self.writerRelease)
+
+    async def readerAcquire(self, priority=0):
+        '''
+        Coroutine to acquire the lock for a Reader.
+
+        Returns without suspending when no writer holds or waits for the lock. See
+        ``TxReadersWriterLock`` for ``priority``.
+        '''
+        if self.tryReaderAcquire(priority):
+            return
+        await self.__wait(self._readerEnqueue, self.readerRelease, priority)
+
+    def readerRelease(self):
+        '''
+        Release the lock by a reader.
+        '''
+        self.readerReleaseNow()
+
+    async def writerAcquire(self, priority=0):
+        '''
+        Coroutine to acquire the lock for a Writer.
+
+        Returns without suspending when the lock is free. See ``TxReadersWriterLock`` for
+        ``priority``.
+        '''
+        if self.tryWriterAcquire():
+            return
+        await self.__wait(self._writerEnqueue, self.writerRelease, priority)
+
+    def writerRelease(self):
+        '''
+        Release the lock by a Writer.
+        '''
+        self.writerReleaseNow()
+
+    def __time(self):
+        if self.__loop is None:
+            try:
+                self.__loop = _getRunningLoop()
+            except RuntimeError:
+                # Not used from its event loop yet, whose clock is the monotonic clock
+                return time.monotonic()
+        return self.__loop.time()
+
+    async def __wait(self, enqueue, release, priority):
+        if self.__loop is None:
+            self.__loop = _getRunningLoop()
+        waiter = self.__loop.create_future()
+        enqueue(waiter, priority)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The lock was handed over to us right before the cancellation
+                release()
+            else:
+                self._removeWaiter(waiter)
+            raise
+
+    def _grantWaiter(self, waiter):
+        if waiter.done():
+            # Cancelled, it will remove itself from the queue
+            return False
+        waiter.set_result(None)
+        return True
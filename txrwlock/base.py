@@ -0,0 +1,559 @@
+# -*- coding: utf-8 -*-
+# State machine shared by the Readers/Writer Lock implementations
+# License:
+#   MIT License
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import heapq
+
+__all__ = [
+    "LockQueueFullError",
+    "PHASE_FAIR",
+    "READER_PREFERRING",
+    "WRITER_PREFERRING",
+]
+
+#: Fairness policies. New readers wait as soon as a writer waits, and writers are served before
+#: waiting readers: readers may starve under a continuous flow of writers.
+WRITER_PREFERRING = "writer-preferring"
+#: New readers only wait while a writer holds the lock: writers may starve under a continuous flow
+#: of readers.
+READER_PREFERRING = "reader-preferring"
+#: New readers wait as soon as a writer waits, but when a writer releases the lock all the readers
+#: that were waiting for it are admitted before the next writer: read and write phases alternate,
+#: so neither side starves.
+PHASE_FAIR = "phase-fair"
+
+_POLICIES = (WRITER_PREFERRING, READER_PREFERRING, PHASE_FAIR)
+
+
+class LockQueueFullError(Exception):
+    '''
+    The lock could not be acquired immediately, and too many requests are already waiting for it.
+    '''
+
+
+class _PriorityQueue(object):
+    '''
+    Waiters served by decreasing priority, in arrival order among equals.
+
+    Has the subset of the ``collections.deque`` API used by the lock. To prevent starvation, a
+    waiter ages as newer ones arrive: it can only be overtaken by the next ``aging`` arrivals per
+    priority level of difference. The keys are fixed when waiters arrive, so this is a plain heap.
+    '''
+
+    __slots__ = ('__heap', '__arrivals', '__aging')
+
+    def __init__(self, aging, waiters=()):
+        self.__heap = []
+        self.__arrivals = 0
+        self.__aging = aging
+        for waiter in waiters:
+            self.push(waiter, 0)
+
+    def __len__(self):
+        return len(self.__heap)
+
+    def __contains__(self, waiter):
+        return any(entry[3] is waiter for entry in self.__heap)
+
+    def __iter__(self):
+        return (entry[3] for entry in sorted(self.__heap))
+
+    def push(self, waiter, priority):
+        self.__arrivals += 1
+        heapq.heappush(
+            self.__heap,
+            (self.__arrivals - priority * self.__aging, self.__arrivals, priority, waiter))
+
+    def popleft(self):
+        return heapq.heappop(self.__heap)[3]
+
+    def remove(self, waiter):
+        self.__heap = [entry for entry in self.__heap if entry[3] is not waiter]
+        heapq.heapify(self.__heap)
+
+    @property
+    def nextPriority(self):
+        '''
+        Priority of the waiter served next.
+        '''
+        return self.__heap[0][2]
+
+    @property
+    def maxPriority(self):
+        return max(entry[2] for entry in self.__heap)
+
+
+# The state is spread over slots, which keeps idle locks small
+class _ReadersWriterLockBase(object):  # pylint: disable=too-many-instance-attributes
+    '''
+    State machine shared by the readers/writer lock implementations.
+
+    It only counts the lock holders and keeps the waiters in arrival order; subclasses decide what
+    a waiter is (a ``Deferred``, an ``asyncio.Future``, ...) by implementing ``_grantWaiter``.
+    Everything runs on a single thread (the reactor or the event loop), so no inner locking is
+    required.
+
+    Waiters are kept in plain deques until one of them has a priority: the queue is then turned
+    into a ``_PriorityQueue``, where a waiter can be overtaken by at most ``priorityAging`` newer
+    arrivals per priority level of difference.
+
+    The lock is never handed over recursively: when a waiter releases the lock from the callback
+    waking it up, the next waiters are woken up once that callback has returned, so any number of
+    waiters can release the lock synchronously.
+    '''
+
+    #: Aging of the waiters with a priority, see ``_PriorityQueue``
+    priorityAging = 16
+
+    __slots__ = (
+        '__weakref__',
+        '__stats',
+        '__rdrs_pass_wrtrs',
+        '__rdrs_after_wrtr',
+        '__limits',
+        '__state',
+        '__version',
+        '__upg_active',
+        '__upg_wtr',
+        '__rdrs_q',
+        '__wrtrs_q',
+        '__upg_q',
+        '__grants',
+    )
+
+    def __init__(self,
+                 stats=None,
+                 policy=WRITER_PREFERRING,
+                 maxQueuedReaders=None,
+                 maxQueuedWriters=None,
+                 onSaturated=None):
+        if policy not in _POLICIES:
+            raise ValueError("Unknown lock policy {0!r}".format(policy))
+        # (maxQueuedReaders, maxQueuedWriters, onSaturated), None when the queues are unbounded
+        self.__limits = None
+        if maxQueuedReaders is not None or maxQueuedWriters is not None:
+            self.__limits = (maxQueuedReaders, maxQueuedWriters, onSaturated)
+        # Optional LockStats, None when instrumentation is disabled
+        self.__stats = stats
+        # Can new readers enter while writers are waiting?
+        self.__rdrs_pass_wrtrs = policy == READER_PREFERRING
+        # Are the waiting readers admitted before the next writer when a writer releases the lock?
+        self.__rdrs_after_wrtr = policy != WRITER_PREFERRING
+        # Holders of the lock: -1 for a writer, else the number of readers (including the
+        # upgradable one)
+        self.__state = 0
+        # Number of completed write sections, for the optimistic reads
+        self.__version = 0
+        # Is one of the readers the upgradable one?
+        self.__upg_active = False
+        # Waiter of the upgradable reader waiting for the other readers to leave, if any
+        self.__upg_wtr = None
+        # Readers, writers and upgradable readers waiting for the lock, in arrival order. The
+        # deques are only allocated while someone waits, so an idle lock stays small.
+        self.__rdrs_q = None
+        self.__wrtrs_q = None
+        self.__upg_q = None
+        # (waiter, refused) grants waiting to be delivered, None unless a grant is being delivered
+        self.__grants = None
+
+    @property
+    def isReading(self):
+        '''
+        Is the lock acquired for read? (will return false if only required for writer)
+        '''
+        return self.__state > 0 and not self.__wrtrs_q and self.__upg_wtr is None
+
+    @property
+    def isWriting(self):
+        '''
+        Is the lock acquired for write?
+        '''
+        return self.__state < 0 or bool(self.__wrtrs_q) or self.__upg_wtr is not None
+
+    @property
+    def isIdle(self):
+        '''
+        Is the lock neither held nor awaited by anyone?
+        '''
+        return not (self.__state or self.__rdrs_q or self.__wrtrs_q or self.__upg_q)
+
+    @property
+    def stats(self):
+        '''
+        ``LockStats`` of this lock, ``None`` if it has been created without ``stats=True``.
+        '''
+        return self.__stats
+
+    @property
+    def _handingOver(self):
+        '''
+        Is the lock waking up the waiters it has been handed over to? Their callbacks then run on
+        behalf of the task which released the lock.
+        '''
+        return self.__grants is not None
+
+    @property
+    def version(self):
+        '''
+        Number of write sections completed so far.
+        '''
+        return self.__version
+
+    def tryOptimisticRead(self):
+        '''
+        Start an optimistic read, that does not acquire the lock.
+
+        Returns a stamp to give to ``validate`` once the share has been read, or ``None`` if a
+        writer currently holds the lock.
+        '''
+        if self.__state < 0:
+            return None
+        return self.__version
+
+    def validate(self, stamp):
+        '''
+        Is what has been read since ``tryOptimisticRead`` returned ``stamp`` consistent, that is
+        no writer has held the lock in between?
+
+        Only reads two integers, with the holders count first, so it can also be called from a
+        worker thread.
+        '''
+        return stamp is not None and self.__state >= 0 and self.__version == stamp
+
+    def __readersMayEnter(self, priority=0):
+        if self.__state < 0 or self.__upg_wtr is not None:
+            return False
+        if self.__rdrs_pass_wrtrs or not self.__wrtrs_q:
+            return True
+        return priority > self.__nextWriterPriority()
+
+    def __nextWriterPriority(self):
+        if isinstance(self.__wrtrs_q, _PriorityQueue):
+            return self.__wrtrs_q.nextPriority
+        return 0
+
+    def __readersOutrankWriters(self):
+        # Does a waiting reader have a higher priority than the next writer?
+        if not self.__rdrs_q or not self.__wrtrs_q:
+            return False
+        if isinstance(self.__rdrs_q, _PriorityQueue):
+            return self.__rdrs_q.maxPriority > self.__nextWriterPriority()
+        return self.__nextWriterPriority() < 0
+
+    def __waitingReadersMayEnter(self):
+        # May the waiting readers be admitted ahead of the waiting writers, if any?
+        if not (self.__rdrs_q or self.__upg_q) or self.__state < 0 or self.__upg_wtr is not None:
+            return False
+        return self.__rdrs_pass_wrtrs or not self.__wrtrs_q or self.__readersOutrankWriters()
+
+    def __enqueue(self, queue, waiter, priority):
+        # Append to a deque while no waiter has a priority
+        if priority or isinstance(queue, _PriorityQueue):
+            if not isinstance(queue, _PriorityQueue):
+                queue = _PriorityQueue(self.priorityAging, queue or ())
+            queue.push(waiter, priority)
+        else:
+            if queue is None:
+                queue = collections.deque()
+            queue.append(waiter)
+        return queue
+
+    def tryReaderAcquire(self, priority=0):
+        '''
+        Acquire the lock for a Reader only if this can be done immediately.
+
+        Returns ``True`` if the lock has been acquired (and must be released), ``False`` if a writer
+        holds or waits for the lock. Never waits nor allocates anything.
+
+        A reader with a ``priority`` higher than the next waiting writer's is not blocked by the
+        waiting writers.
+        '''
+        if self.__readersMayEnter(priority):
+            self.__state += 1
+            if self.__stats is not None:
+                self.__stats.onReaderAcquired()
+            return True
+        return False
+
+    def __refuse(self, role):
+        if self.__stats is not None:
+            if role == "reader":
+                self.__stats.onReaderRejected()
+            else:
+                self.__stats.onWriterRejected()
+        onSaturated = self.__limits[2]
+        if onSaturated is not None:
+            onSaturated(role)
+        raise LockQueueFullError("Too many {0}s waiting for the lock".format(role))
+
+    def __readersQueueFull(self):
+        limit = self.__limits[0]
+        return limit is not None and len(self.__rdrs_q or ()) + len(self.__upg_q or ()) >= limit
+
+    def _readerEnqueue(self, waiter, priority=0):
+        if self.__limits is not None and self.__readersQueueFull():
+            self.__refuse("reader")
+        self.__rdrs_q = self.__enqueue(self.__rdrs_q, waiter, priority)
+        if self.__stats is not None:
+            self.__stats.onReaderQueued(waiter)
+
+    def tryUpgradableAcquire(self):
+        '''
+        Acquire the lock for the upgradable Reader only if this can be done immediately.
+
+        Returns ``False`` if a writer holds or waits for the lock, or if another upgradable reader
+        holds it.
+        '''
+        if not self.__upg_active and self.__readersMayEnter():
+            self.__state += 1
+            self.__upg_active = True
+            if self.__stats is not None:
+                self.__stats.onReaderAcquired()
+            return True
+        return False
+
+    def _upgradableEnqueue(self, waiter):
+        if self.__limits is not None and self.__readersQueueFull():
+            self.__refuse("reader")
+        if self.__upg_q is None:
+            self.__upg_q = collections.deque()
+        self.__upg_q.append(waiter)
+        if self.__stats is not None:
+            self.__stats.onReaderQueued(waiter)
+
+    def tryUpgrade(self):
+        '''
+        Turn the upgradable read lock held by the caller into a write lock, only if this can be
+        done immediately, that is if there is no other reader.
+
+        Returns ``False`` if other readers hold the lock; the caller is then still the upgradable
+        reader.
+        '''
+        if not self.__upg_active or self.__upg_wtr is not None:
+            raise RuntimeError("Upgrade requested without holding the upgradable read lock")
+        if self.__state == 1:
+            self.__promote()
+            return True
+        return False
+
+    def _upgradeEnqueue(self, waiter):
+        # New readers are blocked from now on, the last other reader leaving grants the upgrade
+        self.__upg_wtr = waiter
+        if self.__stats is not None:
+            self.__stats.onUpgradeQueued(waiter)
+
+    def tryWriterAcquire(self):
+        '''
+        Acquire the lock for a Writer only if this can be done immediately.
+
+        Returns ``True`` if the lock has been acquired (and must be released), ``False`` if it is
+        held by anyone or other writers are waiting for it.
+        '''
+        if self.__state == 0 and not self.__wrtrs_q:
+            self.__state = -1
+            if self.__stats is not None:
+                self.__stats.onWriterAcquired()
+            return True
+        return False
+
+    def _writerEnqueue(self, waiter, priority=0):
+        if self.__limits is not None:
+            limit = self.__limits[1]
+            if limit is not None and len(self.__wrtrs_q or ()) >= limit:
+                self.__refuse("writer")
+        self.__wrtrs_q = self.__enqueue(self.__wrtrs_q, waiter, priority)
+        if self.__stats is not None:
+            self.__stats.onWriterQueued(waiter)
+
+    def _removeWaiter(self, waiter):
+        '''
+        Forget about a waiter that gave up before being granted the lock.
+        '''
+        if self.__rdrs_q and waiter in self.__rdrs_q:
+            self.__rdrs_q = self.__without(self.__rdrs_q, waiter)
+            if self.__stats is not None:
+                self.__stats.onReaderDequeued(waiter)
+        elif self.__upg_q and waiter in self.__upg_q:
+            self.__upg_q = self.__without(self.__upg_q, waiter)
+            if self.__stats is not None:
+                self.__stats.onReaderDequeued(waiter)
+        elif (self.__wrtrs_q and waiter in self.__wrtrs_q) or waiter is self.__upg_wtr:
+            if waiter is self.__upg_wtr:
+                self.__upg_wtr = None
+            else:
+                self.__wrtrs_q = self.__without(self.__wrtrs_q, waiter)
+            if self.__stats is not None:
+                self.__stats.onWriterDequeued(waiter)
+            # Readers might have been blocked only by this writer
+            if self.__waitingReadersMayEnter():
+                self.__admitReaders()
+            else:
+                self.__wakeUp()
+
+    @staticmethod
+    def __without(queue, waiter):
+        # Drop the queues left empty, so an idle lock stays small
+        queue.remove(waiter)
+        return queue or None
+
+    def _grantWaiter(self, waiter):
+        '''
+        Wake up a waiter the lock has been handed over to.
+
+        Returns ``False`` if the waiter is no longer interested, in which case the lock is handed
+        over to the next one.
+        '''
+        raise NotImplementedError()
+
+    def readerReleaseNow(self):
+        """
+        Release the lock by a reader, synchronously.
+
+        Returns ``None`` like ``defer.DeferredLock.release()``: the lock is released and waiting
+        writers are woken up before this call returns, so there is nothing to yield.
+        """
+        if self.__state <= 0:
+            raise RuntimeError("Reader release without holding the read lock")
+        self.__state -= 1
+        if self.__stats is not None:
+            self.__stats.onReaderReleased()
+        if self.__state == 0:
+            self.__wakeUp()
+        elif self.__state == 1 and self.__upg_wtr is not None:
+            waiter = self.__upg_wtr
+            self.__upg_wtr = None
+            self.__promote(waiter)
+            self.__grant(waiter, self.writerReleaseNow)
+
+    def upgradableReleaseNow(self):
+        """
+        Release the lock by the upgradable Reader, synchronously.
+
+        The next upgradable reader is admitted, and if it was the last reader, the waiting writers
+        are woken up before this call returns.
+        """
+        if not self.__upg_active:
+            raise RuntimeError("Upgradable release without holding the upgradable read lock")
+        self.__upg_active = False
+        self.readerReleaseNow()
+        if self.__upg_q and not self.__upg_active and self.__readersMayEnter():
+            self.__admitReaders()
+
+    def writerReleaseNow(self):
+        """
+        Release the lock by a Writer, synchronously.
+
+        Returns ``None`` like ``defer.DeferredLock.release()``: the waiting writer, or all the
+        waiting readers, are woken up before this call returns.
+        """
+        if self.__state >= 0:
+            raise RuntimeError("Writer release without holding the write lock")
+        # Bump the version before releasing: see validate
+        self.__version += 1
+        self.__state = 0
+        if self.__stats is not None:
+            self.__stats.onWriterReleased()
+        readersWaiting = self.__rdrs_q or self.__upg_q
+        if (self.__rdrs_after_wrtr and readersWaiting) or self.__readersOutrankWriters():
+            self.__admitReaders()
+        else:
+            self.__wakeUp()
+
+    def downgrade(self):
+        """
+        Turn the write lock held by the caller into a read lock, synchronously.
+
+        No other writer can get the lock in between, and all the readers waiting for the lock are
+        admitted in the same step, before this call returns, so they see what the writer has just
+        written. The caller then releases the lock with ``readerRelease``.
+        """
+        if self.__state >= 0:
+            raise RuntimeError("Downgrade requested without holding the write lock")
+        self.__version += 1
+        self.__state = 1
+        if self.__stats is not None:
+            self.__stats.onWriterReleased()
+            self.__stats.onReaderAcquired()
+        if self.__rdrs_q or self.__upg_q:
+            self.__admitReaders()
+
+    def __promote(self, waiter=None):
+        # The upgradable reader, now alone, becomes the writer
+        self.__state = -1
+        self.__upg_active = False
+        if self.__stats is not None:
+            self.__stats.onReaderReleased()
+            self.__stats.onWriterAcquired(waiter)
+
+    def __grant(self, waiter, refused):
+        # Wake up a waiter the lock has been handed over to, or call refused if it is no longer
+        # interested. The grants made meanwhile, by the waiters releasing the lock from their
+        # callback, are queued and delivered in order by the outermost call, so the stack does not
+        # grow with the number of waiters.
+        if self.__grants is not None:
+            self.__grants.append((waiter, refused))
+            return
+        self.__grants = collections.deque()
+        try:
+            while True:
+                if not self._grantWaiter(waiter):
+                    refused()
+                if not self.__grants:
+                    break
+                waiter, refused = self.__grants.popleft()
+        finally:
+            self.__grants = None
+
+    def __writerRefused(self):
+        self.__state = 0
+        if self.__stats is not None:
+            self.__stats.onWriterReleased()
+        self.__wakeUp()
+
+    def __wakeUp(self):
+        # Hand the lock over to the waiters, writers first (see writerReleaseNow for the policies
+        # admitting readers first)
+        if self.__state < 0:
+            return
+        if self.__wrtrs_q:
+            if self.__state:
+                return
+            waiter = self.__wrtrs_q.popleft()
+            if not self.__wrtrs_q:
+                self.__wrtrs_q = None
+            self.__state = -1
+            if self.__stats is not None:
+                self.__stats.onWriterAcquired(waiter)
+            self.__grant(waiter, self.__writerRefused)
+        elif self.__upg_wtr is None and (self.__rdrs_q or self.__upg_q):
+            self.__admitReaders()
+
+    def __admitReaders(self):
+        # Admit all the waiting readers, and the next upgradable reader if the upgradable slot is
+        # free, in a single pass: the reader count is updated once before any of them is woken
+        # up, so a reader releasing the lock from its callback cannot hand it over to a writer
+        # while the others are still being admitted.
+        rdrs = self.__rdrs_q or ()
+        self.__rdrs_q = None
+        upg = None
+        if self.__upg_q and not self.__upg_active:
+            upg = self.__upg_q.popleft()
+            if not self.__upg_q:
+                self.__upg_q = None
+            self.__upg_active = True
+            self.__state += 1
+        self.__state += len(rdrs)
+        if self.__stats is not None:
+            for waiter in rdrs:
+                self.__stats.onReaderAcquired(waiter)
+            if upg is not None:
+                self.__stats.onReaderAcquired(upg)
+        for waiter in rdrs:
+            self.__grant(waiter, self.readerReleaseNow)
+        if upg is not None:
+            self.__grant(upg, self.upgradableReleaseNow)
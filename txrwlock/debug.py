@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+# Debug mode of the Readers/Writer Locks: who holds what, from where
+# License:
+#   MIT License
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import itertools
+import logging
+import os
+import traceback
+import weakref
+
+from .stats import LockStats
+
+try:
+    import contextvars  # Python 3.7+
+except ImportError:
+    contextvars = None
+
+__all__ = ["DebugLockStats", "disable", "dumpLocks", "enable", "isEnabled"]
+
+logger = logging.getLogger(__name__)
+
+_READ = "read"
+_WRITE = "write"
+
+# Enabled for the locks created from now on, see enable
+_enabled = bool(os.environ.get("TXRWLOCK_DEBUG"))
+_sampleEvery = 1
+# Every lock created in debug mode, for dumpLocks
+_registry = weakref.WeakSet()
+# Requests made by the current logical task (inlineCallbacks or asyncio task) and not released yet
+_requests = contextvars.ContextVar("txrwlock_requests", default=()) if contextvars else None
+
+
+def enable(sampleEvery=1):
+    '''
+    Create the locks in debug mode from now on.
+
+    The acquisition sites (stacks) are captured for one request out of ``sampleEvery``, which
+    bounds the cost of the debug mode on busy locks. Setting the ``TXRWLOCK_DEBUG`` environment
+    variable enables it from the start, with every site captured.
+    '''
+    global _enabled, _sampleEvery  # pylint: disable=global-statement
+    _enabled = True
+    _sampleEvery = sampleEvery
+
+
+def disable():
+    '''
+    Create the locks in normal mode from now on.
+    '''
+    global _enabled  # pylint: disable=global-statement
+    _enabled = False
+
+
+def isEnabled():
+    return _enabled
+
+
+def dumpLocks():
+    '''
+    Describe all the locks created in debug mode which are held or awaited: who holds or waits for
+    them, since when, and from where.
+
+    .. code-block:: python
+
+        import signal
+        from txrwlock import debug
+
+        debug.enable(sampleEvery=10)
+        signal.signal(signal.SIGUSR1, lambda *_: print(debug.dumpLocks()))
+    '''
+    return "\n".join(stats.dump() for stats in list(_registry) if not stats.isIdle)
+
+
+# A plain record
+class _Request(object):  # pylint: disable=too-few-public-methods
+
+    __slots__ = ('mode', 'site', 'since', 'active')
+
+    def __init__(self, mode, site, since):
+        self.mode = mode
+        self.site = site
+        self.since = since
+        # Still held or waited for
+        self.active = True
+
+
+class DebugLockStats(LockStats):
+    '''
+    ``LockStats`` which also keeps track of every holder and waiter of the lock.
+
+    Used by the locks created with ``debug=True`` (or after ``enable``). On top of the
+    statistics, it:
+
+    - records the acquisition sites, as reported by ``dumpLocks``;
+    - logs an error when a task requests a lock it already holds or waits for, and would then
+      wait forever (self-deadlock);
+    - logs an error when a task releases the lock again after having released its own hold, and
+      so releases the hold of another task (double release).
+
+    Tasks are told apart with ``contextvars`` (Python 3.7+): this works for ``inlineCallbacks``
+    generators and asyncio tasks, but callbacks chained on plain deferreds all run in the context
+    that fires them, so the detection is only a heuristic there.
+    '''
+
+    def __init__(self, now, lock):
+        super(DebugLockStats, self).__init__(now)
+        self.__now = now
+        self.__lock = weakref.ref(lock)
+        self.__counter = itertools.count()
+        self.__held = []
+        self.__waiting = {}
+        # (waiter, read hold) of the pending upgrade, if any
+        self.__upgrade = None
+        _registry.add(self)
+
+    @property
+    def isIdle(self):
+        return not (self.__held or self.__waiting)
+
+    def __request(self, mode, checkSelfDeadlock=False):
+        site = None
+        if next(self.__counter) % _sampleEvery == 0:
+            site = traceback.format_stack()[:-3]
+        request = _Request(mode, site, self.__now())
+        if _requests is not None:
+            requests = _requests.get()
+            if checkSelfDeadlock:
+                for other in requests:
+                    if other[0] is self and other[1].active:
+                        logger.error(
+                            "Self-deadlock: %s requested for %s by a task which already %s it "
+                            "for %s\n%s", self.__lock(), mode,
+                            "holds" if other[1] in self.__held else "waits for",
+                            other[1].mode, self.__formatRequest(other[1]))
+                        break
+            _requests.set(requests + ((self, request),))
+        return request
+
+    def __release(self, mode):
+        held = [r for r in self.__held if r.mode == mode]
+        if not held:
+            return
+        released = held[0]
+        if _requests is not None:
+            requests = _requests.get()
+            mine = [r for s, r in requests if s is self and r.mode == mode]
+            own = [r for r in mine if r.active and r in held]
+            if own:
+                released = own[0]
+                released.active = False
+                # Only the last hold released by the task is remembered, to spot a second release
+                kept = tuple(sr for sr in requests if sr[0] is not self or sr[1].active)
+                _requests.set(kept + ((self, released),))
+            elif self.__upgrade is not None and self.__upgrade[1] in held:
+                # The last other reader left: the upgradable reader becomes the writer
+                released = self.__upgrade[1]
+                self.__upgrade = None
+            elif mine and not self.__lock()._handingOver:  # pylint: disable=protected-access
+                logger.error(
+                    "Double release: %s released for %s by a task which has already released "
+                    "it, the hold of another task is released instead. Hold acquired from:\n%s\n"
+                    "Released from:\n%s", self.__lock(), mode, self.__formatRequest(released),
+                    "".join(traceback.format_stack()[:-3]).rstrip("\n"))
+        released.active = False
+        self.__held.remove(released)
+
+    def __dequeue(self, waiter):
+        self.__waiting.pop(waiter).active = False
+
+    def onReaderQueued(self, waiter):
+        super(DebugLockStats, self).onReaderQueued(waiter)
+        self.__waiting[waiter] = self.__request(_READ, checkSelfDeadlock=True)
+
+    def onWriterQueued(self, waiter):
+        super(DebugLockStats, self).onWriterQueued(waiter)
+        self.__waiting[waiter] = self.__request(_WRITE, checkSelfDeadlock=True)
+
+    def onUpgradeQueued(self, waiter):
+        super(DebugLockStats, self).onUpgradeQueued(waiter)
+        if _requests is not None:
+            hold = next((r for s, r in _requests.get()
+                         if s is self and r.mode == _READ and r.active and r in self.__held), None)
+            self.__upgrade = (waiter, hold)
+        self.__waiting[waiter] = self.__request(_WRITE)
+
+    def onReaderDequeued(self, waiter):
+        super(DebugLockStats, self).onReaderDequeued(waiter)
+        self.__dequeue(waiter)
+
+    def onWriterDequeued(self, waiter):
+        super(DebugLockStats, self).onWriterDequeued(waiter)
+        if self.__upgrade is not None and self.__upgrade[0] is waiter:
+            self.__upgrade = None
+        self.__dequeue(waiter)
+
+    def onReaderAcquired(self, waiter=None):
+        super(DebugLockStats, self).onReaderAcquired(waiter)
+        self.__acquired(_READ, waiter)
+
+    def onWriterAcquired(self, waiter=None):
+        super(DebugLockStats, self).onWriterAcquired(waiter)
+        self.__acquired(_WRITE, waiter)
+
+    def __acquired(self, mode, waiter):
+        if waiter is None:
+            request = self.__request(mode)
+        else:
+            request = self.__waiting.pop(waiter)
+            request.mode = mode
+            request.since = self.__now()
+        self.__held.append(request)
+
+    def onReaderReleased(self):
+        super(DebugLockStats, self).onReaderReleased()
+        self.__release(_READ)
+
+    def onWriterReleased(self):
+        super(DebugLockStats, self).onWriterReleased()
+        self.__release(_WRITE)
+
+    def __formatRequest(self, request):
+        if request.site is None:
+            return "    (acquisition site not sampled)"
+        return "".join(request.site).rstrip("\n")
+
+    def dump(self):
+        '''
+        Describe the holders and waiters of the lock.
+        '''
+        now = self.__now()
+        lines = ["{0}:".format(self.__lock())]
+        for state, requests in (("held", self.__held), ("waiting", self.__waiting.values())):
+            for request in sorted(requests, key=lambda r: r.since):
+                lines.append("  {0} for {1} since {2:.3f}s, from:".format(
+                    state, request.mode, now - request.since))
+                lines.append(self.__formatRequest(request))
+        return "\n".join(lines)
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+# Cross-process Readers/Writer Lock, over a lock file
+# License:
+#   MIT License
+#
+# POSIX only (``fcntl``).
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import errno
+import fcntl
+import os
+
+from twisted.internet import defer
+
+from .txrwlock import TxReadersWriterLock
+from .txrwlock import WRITER_PREFERRING
+
+__all__ = ["FileReadersWriterLock"]
+
+_LOCK_BUSY_ERRNOS = (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK)
+
+
+# A local lock, two lock files and the shared state between them
+class FileReadersWriterLock(object):  # pylint: disable=too-many-instance-attributes
+    '''
+    Readers-Writer Lock shared by the processes of a host, through a lock file.
+
+    Same acquisition and release methods as ``TxReadersWriterLock`` (``readerAcquire``,
+    ``readerRelease``, ``readerReleaseNow`` and their writer counterparts); the other helpers are
+    not available. Within a process, the requests are first arbitrated by a local
+    ``TxReadersWriterLock`` (so the fairness policy applies between local requests), then the
+    process takes a shared (``flock(LOCK_SH)``) lock on the file for its readers, or an exclusive
+    (``flock(LOCK_EX)``) one for its writer. All the local readers share the same file lock.
+
+    Between processes, writers have priority: a writer first takes an exclusive lock on a second
+    file, ``path + ".intent"``, and keeps it while it waits for the readers to leave. Every new
+    reader, even one joining a read phase of its process, waits while another process's writer
+    holds that file, so the read phases drain and a writer is never starved by a continuous flow
+    of readers. Readers may starve under a continuous flow of writers.
+
+    The file lock is only ever requested with ``LOCK_NB``: when another process holds it, the
+    attempt is retried every ``pollInterval`` seconds on ``clock``, so the reactor is never
+    blocked.
+
+    .. code-block:: python
+
+        from txrwlock import FileReadersWriterLock
+
+        rwlocker = FileReadersWriterLock("/var/run/myapp/cache.lock")
+
+        @defer.inlineCallbacks
+        def aReaderMethod(...):
+            yield rwlocker.readerAcquire()
+            try:
+                # ... read the memory-mapped cache ...
+            finally:
+                rwlocker.readerReleaseNow()
+
+    The lock files are created if needed and never removed. Call ``close`` to release the file
+    descriptors once the lock is not used anymore.
+    '''
+
+    def __init__(self, path, clock=None, pollInterval=0.01, policy=WRITER_PREFERRING):
+        self.__path = path
+        self.__clock = clock
+        self.__pollInterval = pollInterval
+        self.__local = TxReadersWriterLock(clock=clock, policy=policy)
+        # Serializes the local readers trying to take the shared file lock
+        self.__fileGate = defer.DeferredLock()
+        # Number of local readers covered by the shared file lock
+        self.__sharedCnt = 0
+        # Does a local writer hold the exclusive file lock?
+        self.__writing = False
+        self.__fd = None
+        self.__intentFd = None
+
+    @property
+    def isReading(self):
+        return self.__local.isReading
+
+    @property
+    def isWriting(self):
+        return self.__local.isWriting
+
+    def close(self):
+        '''
+        Close the lock files. The lock must not be held anymore.
+        '''
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+        if self.__intentFd is not None:
+            os.close(self.__intentFd)
+            self.__intentFd = None
+
+    def __getClock(self):
+        if self.__clock is None:
+            from twisted.internet import reactor
+            self.__clock = reactor
+        return self.__clock
+
+    def __getFd(self):
+        if self.__fd is None:
+            self.__fd = os.open(self.__path, os.O_RDWR | os.O_CREAT, 0o644)
+        return self.__fd
+
+    def __getIntentFd(self):
+        if self.__intentFd is None:
+            self.__intentFd = os.open(self.__path + ".intent", os.O_RDWR | os.O_CREAT, 0o644)
+        return self.__intentFd
+
+    def __remaining(self, deadline):
+        if deadline is None:
+            return None
+        return max(0, deadline - self.__getClock().seconds())
+
+    def __lockFile(self, fd, operation, timeout):
+        # Try to lock the file without blocking, and retry later while it is held elsewhere
+        clock = self.__getClock()
+        deadline = None if timeout is None else clock.seconds() + timeout
+        retry = []
+
+        def cancel(_):
+            if retry and retry[0].active():
+                retry[0].cancel()
+
+        d = defer.Deferred(cancel)
+
+        def attempt():
+            del retry[:]
+            try:
+                fcntl.flock(fd, operation | fcntl.LOCK_NB)
+            except (IOError, OSError) as err:
+                if err.errno not in _LOCK_BUSY_ERRNOS:
+                    d.errback()
+                elif deadline is not None and clock.seconds() >= deadline:
+                    d.errback(
+                        defer.TimeoutError("File lock not acquired after {0} seconds".format(
+                            timeout)))
+                else:
+                    retry.append(clock.callLater(self.__pollInterval, attempt))
+                return
+            d.callback(None)
+
+        attempt()
+        return d
+
+    @staticmethod
+    def __unlockFile(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+    @defer.inlineCallbacks
+    def __acquireGate(self, deadline):
+        # Wait for the local reader currently taking the shared file lock, if any
+        d = self.__fileGate.acquire()
+        if d.called or deadline is None:
+            yield d
+            return
+        timedOut = []
+
+        def onTimeout():
+            timedOut.append(True)
+            d.cancel()
+
+        timeoutCall = self.__getClock().callLater(self.__remaining(deadline), onTimeout)
+        try:
+            yield d
+        except defer.CancelledError:
+            if timedOut:
+                raise defer.TimeoutError("File lock not acquired in time")
+            raise
+        finally:
+            if timeoutCall.active():
+                timeoutCall.cancel()
+
+    @defer.inlineCallbacks
+    def readerAcquire(self, timeout=None):
+        """
+        Acquire the lock for a Reader, in this process and among the processes sharing the lock
+        file.
+
+        Fails with ``defer.TimeoutError`` if it could not be acquired after ``timeout`` seconds.
+        """
+        deadline = None if timeout is None else self.__getClock().seconds() + timeout
+        yield self.__local.readerAcquire(timeout=timeout)
+        try:
+            yield self.__acquireGate(deadline)
+            try:
+                # Even when the local readers already hold the shared file lock, wait for the
+                # writers of the other processes: the local read phase must be able to end
+                intentFd = self.__getIntentFd()
+                yield self.__lockFile(intentFd, fcntl.LOCK_SH, self.__remaining(deadline))
+                try:
+                    if not self.__sharedCnt:
+                        yield self.__lockFile(self.__getFd(), fcntl.LOCK_SH,
+                                              self.__remaining(deadline))
+                finally:
+                    self.__unlockFile(intentFd)
+                self.__sharedCnt += 1
+            finally:
+                self.__fileGate.release()
+        except BaseException:
+            self.__local.readerReleaseNow()
+            raise
+
+    def readerReleaseNow(self):
+        """
+        Release the lock by a reader, synchronously.
+        """
+        # Check before touching the file lock, which protects the other local readers
+        if self.__sharedCnt <= 0:
+            raise RuntimeError("Reader release without holding the read lock")
+        self.__sharedCnt -= 1
+        if not self.__sharedCnt:
+            self.__unlockFile(self.__fd)
+        self.__local.readerReleaseNow()
+
+    def readerRelease(self):
+        """
+        Release the lock by a reader.
+        """
+        self.readerReleaseNow()
+        return defer.succeed(None)
+
+    @defer.inlineCallbacks
+    def writerAcquire(self, timeout=None):
+        """
+        Acquire the lock for a Writer, in this process and among the processes sharing the lock
+        file.
+
+        Fails with ``defer.TimeoutError`` if it could not be acquired after ``timeout`` seconds.
+        """
+        deadline = None if timeout is None else self.__getClock().seconds() + timeout
+        yield self.__local.writerAcquire(timeout=timeout)
+        try:
+            # Block the new readers of all the processes while waiting for the current ones
+            intentFd = self.__getIntentFd()
+            yield self.__lockFile(intentFd, fcntl.LOCK_EX, self.__remaining(deadline))
+            try:
+                yield self.__lockFile(self.__getFd(), fcntl.LOCK_EX, self.__remaining(deadline))
+            finally:
+                self.__unlockFile(intentFd)
+        except BaseException:
+            self.__local.writerReleaseNow()
+            raise
+        self.__writing = True
+
+    def writerReleaseNow(self):
+        """
+        Release the lock by a Writer, synchronously.
+        """
+        # Check before touching the file lock, which may protect local readers
+        if not self.__writing:
+            raise RuntimeError("Writer release without holding the write lock")
+        self.__writing = False
+        self.__unlockFile(self.__fd)
+        self.__local.writerReleaseNow()
+
+    def writerRelease(self):
+        """
+        Release the lock by a Writer.
+        """
+        self.writerReleaseNow()
+        return defer.succeed(None)
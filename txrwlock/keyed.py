@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# Many fine-grained Readers/Writer Locks, one per key
+# License:
+#   MIT License
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from twisted.internet import defer
+
+from .txrwlock import TxReadersWriterLock
+from .txrwlock import WRITER_PREFERRING
+
+__all__ = ["KeyedReadersWriterLock", "READ", "WRITE"]
+
+#: Lock modes for ``KeyedReadersWriterLock.acquireMany``
+READ = "read"
+WRITE = "write"
+
+
+class KeyedReadersWriterLock(object):
+    '''
+    One ``TxReadersWriterLock`` per key, created on demand.
+
+    A lock only exists while it is held or awaited: it is created by the first acquisition request
+    on its key and dropped as soon as it becomes idle again (last release, or last waiter timed out
+    or cancelled). Idle keys cost nothing, so this scales to millions of guarded objects.
+
+    All methods take the key as first argument and otherwise behave like their
+    ``TxReadersWriterLock`` counterpart. Keys must be hashable.
+
+    .. code-block:: python
+
+        from txrwlock import KeyedReadersWriterLock
+
+        locks = KeyedReadersWriterLock()
+
+        @defer.inlineCallbacks
+        def updateUser(userId):
+            yield locks.writerAcquire(userId)
+            try:
+                # ... update the user ...
+            finally:
+                locks.writerReleaseNow(userId)
+
+    Operations spanning several keys should use ``acquireMany``, which takes all the locks in a
+    canonical order (so two such operations can never deadlock) behind a single deferred:
+
+    .. code-block:: python
+
+        from txrwlock import READ, WRITE
+
+        @defer.inlineCallbacks
+        def transfer(fromId, toId, auditId):
+            locks = [(fromId, WRITE), (toId, WRITE), (auditId, READ)]
+            yield keyedLocks.acquireMany(locks)
+            try:
+                # ... move things around ...
+            finally:
+                keyedLocks.releaseManyNow(locks)
+    '''
+
+    def __init__(self, clock=None, policy=WRITER_PREFERRING):
+        self.__clock = clock
+        self.__policy = policy
+        self.__locks = {}
+
+    def __len__(self):
+        '''
+        Number of keys currently held or awaited.
+        '''
+        return len(self.__locks)
+
+    def __contains__(self, key):
+        return key in self.__locks
+
+    def __seconds(self):
+        if self.__clock is None:
+            from twisted.internet import reactor
+            self.__clock = reactor
+        return self.__clock.seconds()
+
+    def __getLock(self, key):
+        lock = self.__locks.get(key)
+        if lock is None:
+            lock = self.__locks[key] = TxReadersWriterLock(clock=self.__clock, policy=self.__policy)
+        return lock
+
+    def __evictIfIdle(self, key, lock):
+        if lock.isIdle and self.__locks.get(key) is lock:
+            del self.__locks[key]
+
+    def __watch(self, d, key, lock):
+        # A waiter giving up might leave the lock idle
+        if not d.called:
+
+            def failed(failure):
+                self.__evictIfIdle(key, lock)
+                return failure
+
+            d.addErrback(failed)
+        return d
+
+    def tryReaderAcquire(self, key):
+        # A brand new lock is always granted, so a refused lock is never idle
+        return self.__getLock(key).tryReaderAcquire()
+
+    def tryWriterAcquire(self, key):
+        # A brand new lock is always granted, so a refused lock is never idle
+        return self.__getLock(key).tryWriterAcquire()
+
+    def readerAcquire(self, key, timeout=None):
+        lock = self.__getLock(key)
+        return self.__watch(lock.readerAcquire(timeout=timeout), key, lock)
+
+    def readerReleaseNow(self, key):
+        lock = self.__locks[key]
+        lock.readerReleaseNow()
+        self.__evictIfIdle(key, lock)
+
+    def readerRelease(self, key):
+        lock = self.__locks[key]
+        d = lock.readerRelease()
+        self.__evictIfIdle(key, lock)
+        return d
+
+    def writerAcquire(self, key, timeout=None):
+        lock = self.__getLock(key)
+        return self.__watch(lock.writerAcquire(timeout=timeout), key, lock)
+
+    def writerReleaseNow(self, key):
+        lock = self.__locks[key]
+        lock.writerReleaseNow()
+        self.__evictIfIdle(key, lock)
+
+    def writerRelease(self, key):
+        lock = self.__locks[key]
+        d = lock.writerRelease()
+        self.__evictIfIdle(key, lock)
+        return d
+
+    @staticmethod
+    def __canonical(locks):
+        # One entry per key (writing wins over reading), sorted by key
+        modes = {}
+        for key, mode in locks:
+            if mode not in (READ, WRITE):
+                raise ValueError("Unknown lock mode {0!r}".format(mode))
+            if modes.get(key) != WRITE:
+                modes[key] = mode
+        return sorted(modes.items())
+
+    def acquireMany(self, locks, timeout=None):
+        """
+        Acquire several keys at once.
+
+        ``locks`` is an iterable of ``(key, mode)`` pairs, ``mode`` being ``READ`` or ``WRITE``;
+        keys must be orderable. A key requested in both modes is locked for writing. The locks
+        are acquired in the order of their keys, which prevents deadlocks between concurrent
+        ``acquireMany`` calls, and the returned deferred fires once all of them are held. Free
+        locks are taken synchronously, so when no key is contended the deferred has already
+        fired.
+
+        On failure (``timeout`` seconds elapsed for the whole set, or cancellation of the returned
+        deferred), the locks already acquired are released.
+
+        Release them with ``releaseMany`` or ``releaseManyNow`` and the same ``locks``.
+        """
+        ordered = self.__canonical(locks)
+        state = {"acquired": 0, "pending": None}
+        deadline = None if timeout is None else self.__seconds() + timeout
+
+        def cancel(_):
+            if state["pending"] is not None:
+                state["pending"].cancel()
+
+        result = defer.Deferred(cancel)
+
+        def failed(failure):
+            state["pending"] = None
+            self.__releaseOrdered(ordered[:state["acquired"]])
+            result.errback(failure)
+
+        def acquiredOne(_):
+            state["pending"] = None
+            state["acquired"] += 1
+            step()
+
+        def step():
+            while state["acquired"] < len(ordered):
+                key, mode = ordered[state["acquired"]]
+                if mode == WRITE:
+                    if self.tryWriterAcquire(key):
+                        state["acquired"] += 1
+                        continue
+                    acquire = self.writerAcquire
+                else:
+                    if self.tryReaderAcquire(key):
+                        state["acquired"] += 1
+                        continue
+                    acquire = self.readerAcquire
+                remaining = None if deadline is None else max(0, deadline - self.__seconds())
+                state["pending"] = acquire(key, timeout=remaining)
+                state["pending"].addCallbacks(acquiredOne, failed)
+                return
+            result.callback(None)
+
+        step()
+        return result
+
+    def __releaseOrdered(self, ordered):
+        for key, mode in reversed(ordered):
+            if mode == WRITE:
+                self.writerReleaseNow(key)
+            else:
+                self.readerReleaseNow(key)
+
+    def releaseManyNow(self, locks):
+        """
+        Release, synchronously, the locks acquired with ``acquireMany``.
+        """
+        self.__releaseOrdered(self.__canonical(locks))
+
+    def releaseMany(self, locks):
+        """
+        Release the locks acquired with ``acquireMany``.
+
+        This call is always non-blocking. See ``releaseManyNow`` for a variant that does not
+        allocate a deferred.
+        """
+        self.releaseManyNow(locks)
+        return defer.succeed(None)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# Read-copy-update container, for values read often and replaced rarely
+# License:
+#   MIT License
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+
+from twisted.internet import defer
+
+from .txrwlock import TxReadersWriterLock
+
+__all__ = ["SharedValue"]
+
+
+class SharedValue(object):
+    '''
+    Read-copy-update (RCU) container of a value shared by many readers.
+
+    Readers never wait: they get the current version of the value (a snapshot) immediately, even
+    while a writer is building the next one. Writers are serialized by the writer side of a
+    ``TxReadersWriterLock``; each of them builds a new value from the current one and publishes it
+    atomically, so readers see either the old version or the new one, never a mix of both.
+
+    Snapshots are shared, they must never be modified in place: writers build a modified copy.
+
+    .. code-block:: python
+
+        from txrwlock import SharedValue
+
+        routes = SharedValue({})
+
+        def route(request):
+            # No wait, no lock
+            return routes.value.get(request.path)
+
+        @defer.inlineCallbacks
+        def addRoute(path, handler):
+            yield routes.update(lambda table: dict(table, **{path: handler}))
+
+    Readers that keep using a snapshot across several reactor turns should do so in a ``reading``
+    section. A replaced version is only reclaimed, that is dropped and handed over to ``onReclaim``
+    (to close the files or connections it owns, for example), once the last reader section using
+    it has ended:
+
+    .. code-block:: python
+
+        @defer.inlineCallbacks
+        def dumpRoutes(out):
+            with routes.reading() as table:
+                for path in sorted(table):
+                    yield out.write(path)
+    '''
+
+    def __init__(self, value, clock=None, onReclaim=None):
+        self.__value = value
+        self.__version = 0
+        self.__onReclaim = onReclaim
+        self.__writeLock = TxReadersWriterLock(clock=clock)
+        # Number of running reader sections per version, for the versions that have any
+        self.__readers = {}
+        # Replaced versions still used by reader sections, by version
+        self.__retired = {}
+        # (version, deferred) of the synchronize calls waiting for a version to be reclaimed
+        self.__graceWaiters = []
+
+    @property
+    def value(self):
+        '''
+        Current version of the value. Never waits.
+        '''
+        return self.__value
+
+    @property
+    def version(self):
+        '''
+        Number of times the value has been replaced.
+        '''
+        return self.__version
+
+    @contextlib.contextmanager
+    def reading(self):
+        '''
+        Context manager giving the current snapshot, which is not reclaimed before the end of the
+        section. Never waits.
+        '''
+        version = self.__version
+        self.__readers[version] = self.__readers.get(version, 0) + 1
+        try:
+            yield self.__value
+        finally:
+            remaining = self.__readers[version] - 1
+            if remaining:
+                self.__readers[version] = remaining
+            else:
+                del self.__readers[version]
+                if version in self.__retired:
+                    self.__reclaim(version)
+
+    def update(self, func, *args, **kwargs):
+        """
+        Replace the value by ``func(currentValue, *args, **kwargs)``.
+
+        ``func`` may return a deferred. Calls to ``update`` are serialized: ``func`` always gets
+        the value published by the previous update. Returns a deferred firing with the new value
+        once it has been published. If ``func`` fails, the value is left unchanged.
+        """
+        return self.__writeLock.writeLocked(self.__update)(func, *args, **kwargs)
+
+    def set(self, value):
+        """
+        Replace the value, after the updates already requested.
+        """
+        return self.update(lambda _: value)
+
+    def __update(self, func, *args, **kwargs):
+        d = defer.maybeDeferred(func, self.__value, *args, **kwargs)
+        return d.addCallback(self.__publish)
+
+    def __publish(self, value):
+        old, oldVersion = self.__value, self.__version
+        self.__value = value
+        self.__version += 1
+        if oldVersion in self.__readers:
+            self.__retired[oldVersion] = old
+        else:
+            self.__reclaimValue(old)
+            self.__fireGraceWaiters()
+        return value
+
+    def __reclaim(self, version):
+        self.__reclaimValue(self.__retired.pop(version))
+        self.__fireGraceWaiters()
+
+    def __reclaimValue(self, value):
+        if self.__onReclaim is not None:
+            self.__onReclaim(value)
+
+    def __fireGraceWaiters(self):
+        if not self.__graceWaiters:
+            return
+        oldest = min(self.__retired) if self.__retired else self.__version
+        ready = [d for version, d in self.__graceWaiters if version < oldest]
+        self.__graceWaiters = [(v, d) for v, d in self.__graceWaiters if v >= oldest]
+        for d in ready:
+            d.callback(None)
+
+    def synchronize(self):
+        """
+        Deferred firing once all the versions replaced so far have been reclaimed, that is once
+        the reader sections still using them have ended.
+        """
+        if not self.__retired:
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.__graceWaiters.append((self.__version - 1, d))
+        return d
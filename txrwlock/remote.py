@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+# Readers/Writer Locks served over the network (AMP)
+# License:
+#   MIT License
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import itertools
+import logging
+
+from twisted.internet import defer
+from twisted.internet import protocol
+from twisted.internet import task
+from twisted.protocols import amp
+
+from .keyed import READ
+from .keyed import WRITE
+from .keyed import KeyedReadersWriterLock
+
+__all__ = ["LockClientProtocol", "LockServer", "LockServerFactory", "UnknownLeaseError"]
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownLeaseError(Exception):
+    '''
+    The lease has expired or has already been released.
+    '''
+
+
+class AcquireLock(amp.Command):
+    arguments = [
+        (b'name', amp.Unicode()),
+        (b'mode', amp.Unicode()),
+        (b'timeout', amp.Float(optional=True)),
+    ]
+    response = [
+        (b'lease', amp.Integer()),
+        (b'leaseTime', amp.Float()),
+    ]
+    errors = {
+        defer.TimeoutError: b'TIMEOUT',
+        defer.CancelledError: b'CANCELLED',
+    }
+
+
+class ReleaseLock(amp.Command):
+    arguments = [(b'lease', amp.Integer())]
+    response = []
+    errors = {UnknownLeaseError: b'UNKNOWN_LEASE'}
+
+
+class RenewLeases(amp.Command):
+    arguments = [(b'leases', amp.ListOf(amp.Integer()))]
+    response = [(b'expired', amp.ListOf(amp.Integer()))]
+
+
+# A plain record
+class _Lease(object):  # pylint: disable=too-few-public-methods
+
+    __slots__ = ('name', 'mode', 'owner', 'expiry')
+
+    def __init__(self, name, mode, owner, expiry):
+        self.name = name
+        self.mode = mode
+        self.owner = owner
+        self.expiry = expiry
+
+
+class LockServer(object):
+    '''
+    Named readers/writer locks granted to remote clients as leases.
+
+    Each granted lock is a lease, identified by an integer, which is automatically released if it
+    is not renewed within ``leaseTime`` seconds (crashed or partitioned client), or when the
+    client disconnects.
+
+    Grants are answered as soon as the local lock admits them: when a release lets a whole batch
+    of readers in, their answers are written during the same reactor turn and so leave in as few
+    network writes as the transport can coalesce them into.
+    '''
+
+    def __init__(self, clock=None, leaseTime=30.0):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.__clock = clock
+        self.leaseTime = leaseTime
+        self.__locks = KeyedReadersWriterLock(clock=clock)
+        self.__leases = {}
+        self.__pending = {}
+        self.__leaseIds = itertools.count(1)
+
+    def acquire(self, owner, name, mode, timeout=None):
+        '''
+        Deferred firing with a lease id once the lock ``name`` is held in ``mode`` for ``owner``.
+        '''
+        if mode == WRITE:
+            d = self.__locks.writerAcquire(name, timeout=timeout)
+        elif mode == READ:
+            d = self.__locks.readerAcquire(name, timeout=timeout)
+        else:
+            return defer.fail(ValueError("Unknown lock mode {0!r}".format(mode)))
+        pending = self.__pending.setdefault(owner, set())
+        pending.add(d)
+
+        def granted(_):
+            pending.discard(d)
+            return self.__grant(owner, name, mode)
+
+        def failed(failure):
+            pending.discard(d)
+            return failure
+
+        return d.addCallbacks(granted, failed)
+
+    def __grant(self, owner, name, mode):
+        leaseId = next(self.__leaseIds)
+        expiry = self.__clock.callLater(self.leaseTime, self.__expire, leaseId)
+        self.__leases[leaseId] = _Lease(name, mode, owner, expiry)
+        return leaseId
+
+    def __expire(self, leaseId):
+        lease = self.__leases.get(leaseId)
+        if lease is not None:
+            logger.warning("Lease %d on %r expired", leaseId, lease.name)
+            self.__releaseLease(leaseId)
+
+    def __releaseLease(self, leaseId):
+        lease = self.__leases.pop(leaseId)
+        if lease.expiry.active():
+            lease.expiry.cancel()
+        if lease.mode == WRITE:
+            self.__locks.writerReleaseNow(lease.name)
+        else:
+            self.__locks.readerReleaseNow(lease.name)
+
+    def release(self, owner, leaseId):
+        '''
+        Release the lock held under ``leaseId`` by ``owner``.
+
+        Raises ``UnknownLeaseError`` if ``owner`` holds no such lease: lease ids are predictable,
+        so a client can only release its own leases.
+        '''
+        lease = self.__leases.get(leaseId)
+        if lease is None or lease.owner is not owner:
+            raise UnknownLeaseError("Unknown lease {0}".format(leaseId))
+        self.__releaseLease(leaseId)
+
+    def renew(self, owner, leaseIds):
+        '''
+        Push the expiry of the given leases of ``owner`` back to ``leaseTime`` seconds from now.
+        Returns the ones that have already expired, or that ``owner`` does not hold.
+        '''
+        expired = []
+        for leaseId in leaseIds:
+            lease = self.__leases.get(leaseId)
+            if lease is None or lease.owner is not owner:
+                expired.append(leaseId)
+            else:
+                lease.expiry.reset(self.leaseTime)
+        return expired
+
+    def disconnect(self, owner):
+        '''
+        Cancel the pending requests and release the leases of a client which went away.
+        '''
+        for d in list(self.__pending.pop(owner, ())):
+            d.cancel()
+        for leaseId in [i for i, lease in self.__leases.items() if lease.owner is owner]:
+            self.__releaseLease(leaseId)
+
+
+# Most of the ancestors come from amp.AMP
+class LockServerProtocol(amp.AMP):  # pylint: disable=too-many-ancestors
+    '''
+    Server side of the lock protocol, one per client connection.
+    '''
+
+    def __init__(self, server):
+        amp.AMP.__init__(self)
+        self.__server = server
+
+    @AcquireLock.responder
+    def acquireLock(self, name, mode, timeout=None):
+        d = self.__server.acquire(self, name, mode, timeout=timeout)
+        return d.addCallback(self.__granted)
+
+    def __granted(self, leaseId):
+        return {"lease": leaseId, "leaseTime": self.__server.leaseTime}
+
+    @ReleaseLock.responder
+    def releaseLock(self, lease):
+        self.__server.release(self, lease)
+        return {}
+
+    @RenewLeases.responder
+    def renewLeases(self, leases):
+        return {"expired": self.__server.renew(self, leases)}
+
+    def connectionLost(self, reason):
+        amp.AMP.connectionLost(self, reason)
+        self.__server.disconnect(self)
+
+
+class LockServerFactory(protocol.Factory):
+    '''
+    Factory of the lock server. All its connections share the same ``LockServer``.
+
+    .. code-block:: python
+
+        from twisted.internet import endpoints, reactor
+        from txrwlock import LockServerFactory
+
+        endpoints.serverFromString(reactor, "tcp:7420").listen(LockServerFactory())
+    '''
+
+    def __init__(self, clock=None, leaseTime=30.0):
+        self.lockServer = LockServer(clock=clock, leaseTime=leaseTime)
+
+    def buildProtocol(self, addr):
+        return LockServerProtocol(self.lockServer)
+
+
+class RemoteReadersWriterLock(object):
+    '''
+    A named lock of a lock server, with the ``TxReadersWriterLock`` API.
+
+    Obtained with ``LockClientProtocol.lock``. Requests are pipelined on the connection: many
+    acquisitions and releases can be in flight at once, without waiting for each other's answer.
+
+    Pending acquisitions cannot be cancelled, give them a ``timeout`` instead; the server drops
+    them when it expires.
+    '''
+
+    def __init__(self, client, name):
+        self.__client = client
+        self.__name = name
+        self.__readLeases = []
+        self.__writeLease = None
+
+    def readerAcquire(self, timeout=None):
+        """
+        Deferred to acquire the lock for a Reader. Fails with ``defer.TimeoutError`` if it could
+        not be acquired after ``timeout`` seconds.
+        """
+        d = self.__client.acquire(self.__name, READ, timeout)
+        return d.addCallback(self.__readLeases.append)
+
+    def readerRelease(self):
+        """
+        Release the lock by a reader. The deferred fires once the server has released it.
+        """
+        return self.__client.release(self.__readLeases.pop())
+
+    def readerReleaseNow(self):
+        """
+        Release the lock by a reader, without waiting for the server.
+        """
+        self.__client.releaseNow(self.__readLeases.pop())
+
+    def writerAcquire(self, timeout=None):
+        """
+        Deferred to acquire the lock for a Writer. Fails with ``defer.TimeoutError`` if it could
+        not be acquired after ``timeout`` seconds.
+        """
+
+        def acquired(leaseId):
+            self.__writeLease = leaseId
+
+        return self.__client.acquire(self.__name, WRITE, timeout).addCallback(acquired)
+
+    def writerRelease(self):
+        """
+        Release the lock by a Writer. The deferred fires once the server has released it.
+        """
+        leaseId, self.__writeLease = self.__writeLease, None
+        return self.__client.release(leaseId)
+
+    def writerReleaseNow(self):
+        """
+        Release the lock by a Writer, without waiting for the server.
+        """
+        leaseId, self.__writeLease = self.__writeLease, None
+        self.__client.releaseNow(leaseId)
+
+
+# Most of the ancestors come from amp.AMP
+class LockClientProtocol(amp.AMP):  # pylint: disable=too-many-ancestors
+    '''
+    Client side of the lock protocol.
+
+    Keeps the leases it holds alive: all of them are renewed in a single request every third of
+    the lease time.
+
+    .. code-block:: python
+
+        from twisted.internet import endpoints, reactor
+        from txrwlock import LockClientProtocol
+
+        client = yield endpoints.connectProtocol(
+            endpoints.clientFromString(reactor, "tcp:lockserver:7420"), LockClientProtocol())
+        rwlocker = client.lock(u"config")
+        yield rwlocker.readerAcquire()
+    '''
+
+    def __init__(self, clock=None):
+        amp.AMP.__init__(self)
+        self.__clock = clock
+        self.__leases = set()
+        self.__renewal = None
+        self.__locks = {}
+
+    def lock(self, name):
+        '''
+        The ``RemoteReadersWriterLock`` named ``name`` (a unicode string).
+        '''
+        lock = self.__locks.get(name)
+        if lock is None:
+            lock = self.__locks[name] = RemoteReadersWriterLock(self, name)
+        return lock
+
+    def acquire(self, name, mode, timeout=None):
+        kwargs = {"name": name, "mode": mode}
+        if timeout is not None:
+            kwargs["timeout"] = float(timeout)
+        d = self.callRemote(AcquireLock, **kwargs)
+        return d.addCallback(self.__granted)
+
+    def __granted(self, response):
+        leaseId = response["lease"]
+        self.__leases.add(leaseId)
+        if self.__renewal is None:
+            self.__renewal = task.LoopingCall(self.__renew)
+            if self.__clock is not None:
+                self.__renewal.clock = self.__clock
+            self.__renewal.start(response["leaseTime"] / 3, now=False)
+        return leaseId
+
+    def __renew(self):
+        if not self.__leases:
+            return None
+
+        def renewed(response):
+            for leaseId in response["expired"]:
+                logger.warning("Lease %d expired before being renewed", leaseId)
+                self.__leases.discard(leaseId)
+
+        d = self.callRemote(RenewLeases, leases=sorted(self.__leases))
+        return d.addCallback(renewed).addErrback(logger.error)
+
+    def release(self, leaseId):
+        self.__leases.discard(leaseId)
+        return self.callRemote(ReleaseLock, lease=leaseId).addCallback(lambda _: None)
+
+    def releaseNow(self, leaseId):
+
+        def failed(failure):
+            logger.error("Release of lease %d failed: %s", leaseId, failure.getErrorMessage())
+
+        self.release(leaseId).addErrback(failed)
+
+    def connectionLost(self, reason):
+        if self.__renewal is not None and self.__renewal.running:
+            self.__renewal.stop()
+        amp.AMP.connectionLost(self, reason)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Instrumentation of the Readers/Writer Locks
+# License:
+#   MIT License
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import bisect
+
+__all__ = ["Histogram", "LockStats"]
+
+
+class Histogram(object):
+    '''
+    Histogram of durations, in seconds, with fixed bucket bounds.
+
+    ``buckets`` lists ``(upperBound, count)`` pairs; the last bound is ``float("inf")``.
+    '''
+
+    DEFAULT_BOUNDS = (0.0001, 0.001, 0.01, 0.1, 1.0, 10.0)
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.__bounds = tuple(bounds) + (float("inf"), )
+        self.__counts = [0] * len(self.__bounds)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        '''
+        Add a duration to the histogram.
+        '''
+        self.__counts[bisect.bisect_left(self.__bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    @property
+    def buckets(self):
+        return list(zip(self.__bounds, self.__counts))
+
+
+# A plain record of the counters and histograms, read by the applications
+class LockStats(object):  # pylint: disable=too-many-instance-attributes
+    '''
+    Statistics of a Readers/Writer lock.
+
+    Enabled with ``stats=True`` on the lock constructor and available through its ``stats``
+    property. Times are measured with the clock of the lock.
+
+    Attributes:
+
+    - ``readAcquisitions``, ``writeAcquisitions``: number of times the lock has been granted
+    - ``readers``, ``peakReaders``: current and maximum number of simultaneous readers
+    - ``queuedReaders``, ``queuedWriters`` and their ``peak*`` counterparts: requests waiting for
+      the lock
+    - ``rejectedReaders``, ``rejectedWriters``: requests refused because the waiting queue was full
+    - ``readWaitTimes``, ``writeWaitTimes``: ``Histogram`` of the time spent waiting for the lock
+    - ``writeHoldTimes``: ``Histogram`` of the time a writer held the lock
+    - ``readHoldTimes``: ``Histogram`` of the time the lock stayed opened to readers, from the
+      first reader in to the last one out (readers are anonymous, so individual hold times are not
+      known)
+
+    The ``on*`` methods are called by the lock itself.
+    '''
+
+    def __init__(self, now):
+        self.__now = now
+        self.__queuedAt = {}
+        self.__readStart = None
+        self.__writeStart = None
+        self.readAcquisitions = 0
+        self.writeAcquisitions = 0
+        self.readers = 0
+        self.peakReaders = 0
+        self.queuedReaders = 0
+        self.queuedWriters = 0
+        self.peakQueuedReaders = 0
+        self.peakQueuedWriters = 0
+        self.rejectedReaders = 0
+        self.rejectedWriters = 0
+        self.readWaitTimes = Histogram()
+        self.writeWaitTimes = Histogram()
+        self.readHoldTimes = Histogram()
+        self.writeHoldTimes = Histogram()
+
+    def onReaderQueued(self, waiter):
+        self.__queuedAt[waiter] = self.__now()
+        self.queuedReaders += 1
+        self.peakQueuedReaders = max(self.peakQueuedReaders, self.queuedReaders)
+
+    def onWriterQueued(self, waiter):
+        self.__writerQueued(waiter)
+
+    def onUpgradeQueued(self, waiter):
+        # Not through onWriterQueued, which subclasses may override for the plain writers
+        self.__writerQueued(waiter)
+
+    def __writerQueued(self, waiter):
+        self.__queuedAt[waiter] = self.__now()
+        self.queuedWriters += 1
+        self.peakQueuedWriters = max(self.peakQueuedWriters, self.queuedWriters)
+
+    def onReaderDequeued(self, waiter):
+        del self.__queuedAt[waiter]
+        self.queuedReaders -= 1
+
+    def onWriterDequeued(self, waiter):
+        del self.__queuedAt[waiter]
+        self.queuedWriters -= 1
+
+    def onReaderRejected(self):
+        self.rejectedReaders += 1
+
+    def onWriterRejected(self):
+        self.rejectedWriters += 1
+
+    def onReaderAcquired(self, waiter=None):
+        now = self.__now()
+        if waiter is None:
+            self.readWaitTimes.record(0.0)
+        else:
+            self.readWaitTimes.record(now - self.__queuedAt.pop(waiter))
+            self.queuedReaders -= 1
+        self.readAcquisitions += 1
+        self.readers += 1
+        self.peakReaders = max(self.peakReaders, self.readers)
+        if self.readers == 1:
+            self.__readStart = now
+
+    def onWriterAcquired(self, waiter=None):
+        now = self.__now()
+        if waiter is None:
+            self.writeWaitTimes.record(0.0)
+        else:
+            self.writeWaitTimes.record(now - self.__queuedAt.pop(waiter))
+            self.queuedWriters -= 1
+        self.writeAcquisitions += 1
+        self.__writeStart = now
+
+    def onReaderReleased(self):
+        self.readers -= 1
+        if self.readers == 0:
+            self.readHoldTimes.record(self.__now() - self.__readStart)
+
+    def onWriterReleased(self):
+        self.writeHoldTimes.record(self.__now() - self.__writeStart)
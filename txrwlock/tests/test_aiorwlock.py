@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+
+from txrwlock import TxTestCase
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    from txrwlock import AsyncReadersWriterLock
+    from txrwlock import LockQueueFullError
+
+
+class AsyncReadersWriterLockTestCase(TxTestCase):
+
+    if sys.version_info < (3, 5):
+        skip = "asyncio backend requires Python 3.5+"
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def run_(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def testReaderLock(self):
+        lock = AsyncReadersWriterLock()
+        self.run_(lock.readerAcquire())
+        self.run_(lock.readerAcquire())
+        self.assertTrue(lock.isReading)
+        self.assertFalse(lock.isWriting)
+        lock.readerRelease()
+        lock.readerRelease()
+        self.assertFalse(lock.isReading)
+
+    def testWaitingWriterBlocksNewReaders(self):
+        lock = AsyncReadersWriterLock()
+        self.run_(lock.readerAcquire())
+        writer = self.loop.create_task(lock.writerAcquire())
+        reader = self.loop.create_task(lock.readerAcquire())
+        self.run_(asyncio.sleep(0))
+        self.assertFalse(writer.done())
+        self.assertFalse(reader.done())
+        lock.readerRelease()
+        self.run_(writer)
+        self.assertFalse(reader.done())
+        lock.writerRelease()
+        self.run_(reader)
+        self.assertTrue(lock.isReading)
+        lock.readerRelease()
+
+    def testContextManagers(self):
+        lock = AsyncReadersWriterLock()
+        self.run_(lock.writer.__aenter__())
+        self.assertTrue(lock.isWriting)
+        self.run_(lock.writer.__aexit__(None, None, None))
+        self.assertFalse(lock.isWriting)
+        self.run_(lock.reader.__aenter__())
+        self.assertTrue(lock.isReading)
+        self.run_(lock.reader.__aexit__(None, None, None))
+        self.assertFalse(lock.isReading)
+
+    def testCancelledWriterUnblocksReaders(self):
+        lock = AsyncReadersWriterLock()
+        self.run_(lock.readerAcquire())
+        writer = self.loop.create_task(lock.writerAcquire())
+        self.run_(asyncio.sleep(0))
+        reader = self.loop.create_task(lock.readerAcquire())
+        self.run_(asyncio.sleep(0))
+        self.assertFalse(reader.done())
+        writer.cancel()
+        self.run_(reader)
+        self.assertTrue(writer.cancelled())
+        self.assertTrue(lock.isReading)
+        lock.readerRelease()
+        lock.readerRelease()
+        self.assertFalse(lock.isReading)
+        self.assertFalse(lock.isWriting)
+
+    def testNoEventLoopLookup(self):
+
+        def getEventLoop():
+            raise RuntimeError("There is no current event loop")
+
+        # Deprecated outside of a running loop, and failing on recent Pythons
+        self.patch(asyncio, "get_event_loop", getEventLoop)
+        lock = AsyncReadersWriterLock(stats=True)
+        self.assertTrue(lock.tryReaderAcquire())
+        writer = self.loop.create_task(lock.writerAcquire())
+        self.run_(asyncio.sleep(0))
+        self.assertFalse(writer.done())
+        lock.readerRelease()
+        self.run_(writer)
+        lock.writerRelease()
+        self.assertEqual(lock.stats.writeAcquisitions, 1)
+
+    def testBoundedQueues(self):
+        lock = AsyncReadersWriterLock(maxQueuedWriters=1)
+        self.run_(lock.readerAcquire())
+        writer = self.loop.create_task(lock.writerAcquire())
+        self.run_(asyncio.sleep(0))
+        self.assertRaises(LockQueueFullError, self.run_, lock.writerAcquire())
+        lock.readerRelease()
+        self.run_(writer)
+        self.assertTrue(lock.isWriting)
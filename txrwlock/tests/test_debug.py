@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+
+from twisted.internet import defer
+from twisted.internet import task
+
+from txrwlock import TxReadersWriterLock
+from txrwlock import TxTestCase
+from txrwlock import debug
+
+
+class DebugModeTestCase(TxTestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+
+    def testDumpLocks(self):
+        lock = TxReadersWriterLock(clock=self.clock, debug=True)
+        self.assertIsInstance(lock.stats, debug.DebugLockStats)
+        lock.writerAcquire()
+        self.clock.advance(2)
+        dReader = lock.readerAcquire()
+        self.clock.advance(1)
+        dump = debug.dumpLocks()
+        self.assertIn(repr(lock), dump)
+        self.assertIn("held for write since 3.000s", dump)
+        self.assertIn("waiting for read since 1.000s", dump)
+        self.assertIn("testDumpLocks", dump)
+        lock.writerReleaseNow()
+        self.successResultOf(dReader)
+        self.assertIn("held for read since 0.000s", lock.stats.dump())
+        lock.readerReleaseNow()
+        self.assertNotIn(repr(lock), debug.dumpLocks())
+
+    def testEnable(self):
+        # Cleanups run in reverse order
+        self.addCleanup(debug.disable)
+        self.addCleanup(debug.enable, sampleEvery=1)
+        debug.enable(sampleEvery=2)
+        lock = TxReadersWriterLock(clock=self.clock)
+        self.assertIsInstance(lock.stats, debug.DebugLockStats)
+        lock.readerAcquire()
+        lock.readerAcquire()
+        self.assertIn("not sampled", lock.stats.dump())
+        lock.readerReleaseNow()
+        lock.readerReleaseNow()
+        debug.disable()
+        self.assertIsNone(TxReadersWriterLock().stats)
+
+    @defer.inlineCallbacks
+    def testSelfDeadlock(self):
+        if sys.version_info < (3, 7):
+            raise self.skipTest("contextvars requires Python 3.7+")
+        lock = TxReadersWriterLock(clock=self.clock, debug=True)
+        pending = []
+
+        @defer.inlineCallbacks
+        def reentrant():
+            yield lock.writerAcquire()
+            pending.append(lock.writerAcquire())
+
+        @defer.inlineCallbacks
+        def other():
+            pending.append(lock.readerAcquire())
+            yield pending[-1]
+
+        with self.assertLogs("txrwlock.debug", "ERROR") as logs:
+            yield reentrant()
+            other()
+            # Another task waiting for the lock is not a self-deadlock
+            debug.logger.error("end of test")
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn("Self-deadlock", logs.output[0])
+        self.assertIn("reentrant", logs.output[0])
+        pending[0].cancel()
+        self.failureResultOf(pending[0], defer.CancelledError)
+        lock.writerReleaseNow()
+        yield pending[1]
+        lock.readerReleaseNow()
+
+    @defer.inlineCallbacks
+    def testDoubleRelease(self):
+        if sys.version_info < (3, 7):
+            raise self.skipTest("contextvars requires Python 3.7+")
+        lock = TxReadersWriterLock(clock=self.clock, debug=True)
+
+        @defer.inlineCallbacks
+        def holder():
+            yield lock.readerAcquire()
+
+        @defer.inlineCallbacks
+        def reader(done):
+            yield lock.readerAcquire()
+            yield done
+            lock.readerReleaseNow()
+
+        @defer.inlineCallbacks
+        def upgrader():
+            yield lock.upgradableAcquire()
+            yield lock.upgrade()
+            lock.writerReleaseNow()
+
+        @defer.inlineCallbacks
+        def releasesTwice():
+            yield lock.readerAcquire()
+            lock.readerReleaseNow()
+            lock.readerReleaseNow()
+
+        with self.assertLogs("txrwlock.debug", "ERROR") as logs:
+            # Releasing a hold acquired by another task, or handing the upgradable reader's hold
+            # over to the upgrade, is not a double release
+            yield holder()
+            lock.readerReleaseNow()
+            done = defer.Deferred()
+            reader(done)
+            dUpgrader = upgrader()
+            done.callback(None)
+            yield dUpgrader
+            yield holder()
+            yield releasesTwice()
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("Double release", logs.output[0])
+        self.assertIn("holder", logs.output[0])
+        self.assertIn("releasesTwice", logs.output[0])
+        self.assertEqual(lock.stats.readers, 0)
+        self.assertEqual(debug.dumpLocks(), "")
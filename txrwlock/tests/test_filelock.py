@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from twisted.internet import defer
+from twisted.internet import task
+
+from txrwlock import TxTestCase
+
+try:
+    from txrwlock import FileReadersWriterLock
+except ImportError:
+    FileReadersWriterLock = None
+
+
+class FileReadersWriterLockTestCase(TxTestCase):
+
+    if FileReadersWriterLock is None:
+        skip = "fcntl is not available"
+
+    def setUp(self):
+        self.clock = task.Clock()
+        path = self.mktemp()
+        # flock() locks are bound to the open file description: two instances in the same
+        # process behave like two processes
+        self.lock1 = FileReadersWriterLock(path, clock=self.clock, pollInterval=0.1)
+        self.lock2 = FileReadersWriterLock(path, clock=self.clock, pollInterval=0.1)
+        self.addCleanup(self.lock1.close)
+        self.addCleanup(self.lock2.close)
+
+    def testReadersShareTheFile(self):
+        self.assertTrue(self.lock1.readerAcquire().called)
+        self.assertTrue(self.lock1.readerAcquire().called)
+        self.assertTrue(self.lock2.readerAcquire().called)
+        self.lock1.readerReleaseNow()
+        self.lock1.readerReleaseNow()
+        self.lock2.readerReleaseNow()
+        self.assertTrue(self.lock1.writerAcquire().called)
+        self.lock1.writerReleaseNow()
+
+    def testWriterExcludesOtherProcess(self):
+        self.lock1.readerAcquire()
+        dWriter = self.lock2.writerAcquire()
+        self.assertFalse(dWriter.called)
+        self.clock.advance(0.1)
+        self.assertFalse(dWriter.called)
+        self.lock1.readerReleaseNow()
+        self.clock.advance(0.1)
+        self.assertTrue(dWriter.called)
+        dReader = self.lock1.readerAcquire()
+        self.clock.advance(0.1)
+        self.assertFalse(dReader.called)
+        self.lock2.writerReleaseNow()
+        self.clock.advance(0.1)
+        self.successResultOf(dReader)
+        self.lock1.readerReleaseNow()
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def testWriterNotStarvedByOtherProcessReaders(self):
+        self.lock1.readerAcquire()
+        dWriter = self.lock2.writerAcquire()
+        self.clock.advance(0.1)
+        # While the writer waits, new readers do not join the read phase of their process
+        dReader = self.lock1.readerAcquire()
+        self.clock.advance(0.1)
+        self.assertNoResult(dReader)
+        self.lock1.readerReleaseNow()
+        self.clock.advance(0.1)
+        self.successResultOf(dWriter)
+        self.assertNoResult(dReader)
+        self.lock2.writerReleaseNow()
+        self.clock.advance(0.1)
+        self.successResultOf(dReader)
+        self.lock1.readerReleaseNow()
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def testTimeout(self):
+        self.lock1.writerAcquire()
+        dReader = self.lock2.readerAcquire(timeout=1)
+        dReader2 = self.lock2.readerAcquire(timeout=0.5)
+        self.clock.pump([0.1] * 5)
+        self.failureResultOf(dReader2, defer.TimeoutError)
+        self.assertNoResult(dReader)
+        self.clock.pump([0.1] * 6)
+        self.failureResultOf(dReader, defer.TimeoutError)
+        self.assertFalse(self.lock2.isReading)
+        self.lock1.writerReleaseNow()
+        self.assertTrue(self.lock2.writerAcquire().called)
+        self.lock2.writerReleaseNow()
+
+    def testUnbalancedReleaseKeepsTheFileLock(self):
+        self.assertRaises(RuntimeError, self.lock1.readerReleaseNow)
+        self.assertRaises(RuntimeError, self.lock1.writerReleaseNow)
+        # The shared file lock is still taken by the next reader
+        self.lock1.readerAcquire()
+        dWriter = self.lock2.writerAcquire()
+        self.clock.advance(0.1)
+        self.assertNoResult(dWriter)
+        # A stray writer release does not drop the readers' shared file lock
+        self.assertRaises(RuntimeError, self.lock1.writerReleaseNow)
+        self.clock.advance(0.1)
+        self.assertNoResult(dWriter)
+        self.lock1.readerReleaseNow()
+        self.clock.advance(0.1)
+        self.successResultOf(dWriter)
+        self.lock2.writerReleaseNow()
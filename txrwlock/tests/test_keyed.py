@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from twisted.internet import defer
+from twisted.internet import task
+
+from txrwlock import READ
+from txrwlock import WRITE
+from txrwlock import KeyedReadersWriterLock
+from txrwlock import TxTestCase
+
+
+class KeyedReadersWriterLockTestCase(TxTestCase):
+
+    def testKeysAreIndependent(self):
+        locks = KeyedReadersWriterLock()
+        self.assertTrue(locks.writerAcquire("a").called)
+        self.assertTrue(locks.writerAcquire("b").called)
+        self.assertFalse(locks.tryReaderAcquire("a"))
+        self.assertEqual(2, len(locks))
+        locks.writerReleaseNow("a")
+        locks.writerReleaseNow("b")
+        self.assertEqual(0, len(locks))
+
+    def testIdleLocksAreEvicted(self):
+        locks = KeyedReadersWriterLock()
+        locks.readerAcquire("a")
+        locks.readerAcquire("a")
+        dWriter = locks.writerAcquire("a")
+        locks.readerReleaseNow("a")
+        locks.readerReleaseNow("a")
+        self.assertTrue(dWriter.called)
+        self.assertIn("a", locks)
+        locks.writerReleaseNow("a")
+        self.assertNotIn("a", locks)
+        self.assertTrue(locks.tryWriterAcquire("a"))
+        self.successResultOf(locks.writerRelease("a"))
+        self.assertNotIn("a", locks)
+
+    def testFailedWaiterEvictsIdleLock(self):
+        clock = task.Clock()
+        locks = KeyedReadersWriterLock(clock=clock)
+        locks.writerAcquire("a")
+        dReader = locks.readerAcquire("a", timeout=1)
+        dWriter = locks.writerAcquire("a")
+        locks.writerReleaseNow("a")
+        self.assertTrue(dWriter.called)
+        clock.advance(1)
+        self.failureResultOf(dReader, defer.TimeoutError)
+        self.assertIn("a", locks)
+        dReader = locks.readerAcquire("a")
+        locks.writerReleaseNow("a")
+        self.assertTrue(dReader.called)
+        locks.readerReleaseNow("a")
+        dReader = locks.readerAcquire("b")
+        locks.writerAcquire("c")
+        dReader = locks.readerAcquire("c")
+        dReader.cancel()
+        self.failureResultOf(dReader, defer.CancelledError)
+        locks.writerReleaseNow("c")
+        locks.readerReleaseNow("b")
+        self.assertEqual(0, len(locks))
+
+    def testAcquireManyUncontended(self):
+        locks = KeyedReadersWriterLock()
+        pairs = [("b", READ), ("a", WRITE), ("b", WRITE), ("c", READ)]
+        self.assertTrue(locks.acquireMany(pairs).called)
+        self.assertFalse(locks.tryReaderAcquire("a"))
+        self.assertFalse(locks.tryReaderAcquire("b"))
+        self.assertTrue(locks.tryReaderAcquire("c"))
+        locks.readerReleaseNow("c")
+        locks.releaseManyNow(pairs)
+        self.assertEqual(0, len(locks))
+
+    def testAcquireManyInKeyOrder(self):
+        locks = KeyedReadersWriterLock()
+        locks.writerAcquire("b")
+        d1 = locks.acquireMany([("c", WRITE), ("b", WRITE), ("a", WRITE)])
+        # "a" is taken, then the call waits for "b" without touching "c"
+        self.assertFalse(d1.called)
+        self.assertFalse(locks.tryWriterAcquire("a"))
+        self.assertTrue(locks.tryWriterAcquire("c"))
+        locks.writerReleaseNow("c")
+        d2 = locks.acquireMany([("a", READ), ("c", READ)])
+        self.assertFalse(d2.called)
+        locks.writerReleaseNow("b")
+        self.assertTrue(d1.called)
+        self.assertFalse(d2.called)
+        locks.releaseManyNow([("a", WRITE), ("b", WRITE), ("c", WRITE)])
+        self.assertTrue(d2.called)
+        locks.releaseManyNow([("a", READ), ("c", READ)])
+        self.assertEqual(0, len(locks))
+
+    def testAcquireManyFailureReleasesAcquiredLocks(self):
+        clock = task.Clock()
+        locks = KeyedReadersWriterLock(clock=clock)
+        locks.writerAcquire("b")
+        d = locks.acquireMany([("a", WRITE), ("b", READ)], timeout=2)
+        clock.advance(2)
+        self.failureResultOf(d, defer.TimeoutError)
+        self.assertNotIn("a", locks)
+        d = locks.acquireMany([("a", WRITE), ("b", READ)])
+        d.cancel()
+        self.failureResultOf(d, defer.CancelledError)
+        self.assertNotIn("a", locks)
+        locks.writerReleaseNow("b")
+        self.assertEqual(0, len(locks))
+        self.assertRaises(ValueError, locks.acquireMany, [("a", "execute")])
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from twisted.internet import defer
+
+from txrwlock import SharedValue
+from txrwlock import TxTestCase
+
+
+class SharedValueTestCase(TxTestCase):
+
+    def testReadersSeeSnapshots(self):
+        shared = SharedValue({"a": 1})
+        self.assertEqual(shared.value, {"a": 1})
+        with shared.reading() as snapshot:
+            newValue = self.successResultOf(shared.update(lambda v: dict(v, b=2)))
+            self.assertEqual(snapshot, {"a": 1})
+            self.assertEqual(shared.value, {"a": 1, "b": 2})
+        self.assertIs(shared.value, newValue)
+        self.assertEqual(shared.version, 1)
+
+    def testUpdatesAreSerialized(self):
+        shared = SharedValue(0)
+        pending = defer.Deferred()
+        d1 = shared.update(lambda v: pending.addCallback(lambda _: v + 1))
+        d2 = shared.update(lambda v: v * 10)
+        # Readers never wait for the writers
+        self.assertEqual(shared.value, 0)
+        self.assertNoResult(d2)
+        pending.callback(None)
+        self.assertEqual(self.successResultOf(d1), 1)
+        self.assertEqual(self.successResultOf(d2), 10)
+        self.assertEqual(self.successResultOf(shared.set(3)), 3)
+
+    def testFailedUpdate(self):
+        shared = SharedValue(1)
+        self.failureResultOf(shared.update(lambda v: v / 0), ZeroDivisionError)
+        self.assertEqual(shared.value, 1)
+        self.assertEqual(shared.version, 0)
+        self.assertEqual(self.successResultOf(shared.set(2)), 2)
+
+    def testReclaimAfterLastReader(self):
+        reclaimed = []
+        shared = SharedValue("v0", onReclaim=reclaimed.append)
+        shared.set("v1")
+        self.assertEqual(reclaimed, ["v0"])
+        section1 = shared.reading()
+        section2 = shared.reading()
+        self.assertEqual(section1.__enter__(), "v1")
+        self.assertEqual(section2.__enter__(), "v1")
+        shared.set("v2")
+        grace = shared.synchronize()
+        section1.__exit__(None, None, None)
+        self.assertEqual(reclaimed, ["v0"])
+        self.assertNoResult(grace)
+        section2.__exit__(None, None, None)
+        self.assertEqual(reclaimed, ["v0", "v1"])
+        self.successResultOf(grace)
+        self.successResultOf(shared.synchronize())
+
+    def testCancelledUpdate(self):
+        shared = SharedValue(0)
+        pending = defer.Deferred()
+        d1 = shared.update(lambda v: pending.addCallback(lambda _: v + 1))
+        d2 = shared.update(lambda v: v + 10)
+        d3 = shared.update(lambda v: v * 2)
+        d2.cancel()
+        self.failureResultOf(d2, defer.CancelledError)
+        # The update in progress still excludes the others
+        self.assertNoResult(d3)
+        pending.callback(None)
+        self.assertEqual(self.successResultOf(d1), 1)
+        self.assertEqual(self.successResultOf(d3), 2)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from twisted.internet import defer
+from twisted.internet import endpoints
+from twisted.internet import reactor
+from twisted.internet import task
+
+from txrwlock import LockClientProtocol
+from txrwlock import LockServerFactory
+from txrwlock import TxTestCase
+from txrwlock.remote import LockServer
+from txrwlock.remote import ReleaseLock
+from txrwlock.remote import UnknownLeaseError
+
+
+class _TrackedClientProtocol(LockClientProtocol):  # pylint: disable=too-many-ancestors
+
+    def __init__(self, clock=None):
+        LockClientProtocol.__init__(self, clock=clock)
+        self.lost = defer.Deferred()
+
+    def connectionLost(self, reason):
+        LockClientProtocol.connectionLost(self, reason)
+        self.lost.callback(None)
+
+
+class _TrackedServerFactory(LockServerFactory):
+
+    def __init__(self, clock=None, leaseTime=30.0):
+        LockServerFactory.__init__(self, clock=clock, leaseTime=leaseTime)
+        self.lost = []
+
+    def buildProtocol(self, addr):
+        proto = LockServerFactory.buildProtocol(self, addr)
+        lost = defer.Deferred()
+        self.lost.append(lost)
+        connectionLost = proto.connectionLost
+
+        def trackedConnectionLost(reason):
+            connectionLost(reason)
+            lost.callback(None)
+
+        proto.connectionLost = trackedConnectionLost
+        return proto
+
+
+class RemoteReadersWriterLockTestCase(TxTestCase):
+    '''
+    Lock server listening on the loopback interface, with its lease and timeout clock simulated.
+    '''
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.factory = _TrackedServerFactory(clock=self.clock, leaseTime=30.0)
+        self.port = reactor.listenTCP(0, self.factory, interface="127.0.0.1")
+        self.clients = []
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        for client in self.clients:
+            if not client.lost.called:
+                client.transport.loseConnection()
+        yield defer.gatherResults([c.lost for c in self.clients] + self.factory.lost)
+        yield self.port.stopListening()
+
+    def connect(self):
+        endpoint = endpoints.TCP4ClientEndpoint(reactor, "127.0.0.1", self.port.getHost().port)
+        client = _TrackedClientProtocol(task.Clock())
+        self.clients.append(client)
+        return endpoints.connectProtocol(endpoint, client)
+
+    @defer.inlineCallbacks
+    def testReadersShareWritersExclude(self):
+        client1 = yield self.connect()
+        client2 = yield self.connect()
+        lock1 = client1.lock(u"res")
+        lock2 = client2.lock(u"res")
+        yield lock1.readerAcquire()
+        yield lock2.readerAcquire()
+        written = lock2.writerAcquire()
+        yield lock1.readerRelease()
+        self.assertFalse(written.called)
+        yield lock2.readerRelease()
+        yield written
+        yield lock2.writerRelease()
+
+    @defer.inlineCallbacks
+    def testIndependentNames(self):
+        client = yield self.connect()
+        yield client.lock(u"a").writerAcquire()
+        yield client.lock(u"b").writerAcquire()
+
+    @defer.inlineCallbacks
+    def testPipelinedRequests(self):
+        client = yield self.connect()
+        lock = client.lock(u"res")
+        # All the requests are sent before the first answer comes back
+        yield defer.gatherResults([lock.readerAcquire() for _ in range(50)])
+        for _ in range(50):
+            lock.readerReleaseNow()
+        yield lock.writerAcquire()
+        lock.writerReleaseNow()
+
+    @defer.inlineCallbacks
+    def testQueuedReadersGrantedTogether(self):
+        client1 = yield self.connect()
+        client2 = yield self.connect()
+        yield client1.lock(u"res").writerAcquire()
+        lock2 = client2.lock(u"res")
+        reads = [lock2.readerAcquire() for _ in range(10)]
+        # Let the requests reach the server
+        yield client2.lock(u"other").readerAcquire()
+        client1.lock(u"res").writerReleaseNow()
+        yield defer.gatherResults(reads)
+
+    @defer.inlineCallbacks
+    def testTimeout(self):
+        client1 = yield self.connect()
+        client2 = yield self.connect()
+        yield client1.lock(u"res").writerAcquire()
+        d = client2.lock(u"res").readerAcquire(timeout=5)
+        yield client2.lock(u"other").readerAcquire()
+        self.clock.advance(5)
+        yield self.assertFailure(d, defer.TimeoutError)
+
+    @defer.inlineCallbacks
+    def testLeaseExpiry(self):
+        client1 = yield self.connect()
+        client2 = yield self.connect()
+        # client1 never renews its lease: its clock does not advance
+        yield client1.lock(u"res").writerAcquire()
+        d = client2.lock(u"res").writerAcquire()
+        yield client2.lock(u"other").readerAcquire()
+        self.clock.advance(30)
+        yield d
+
+    @defer.inlineCallbacks
+    def testDisconnectReleases(self):
+        client1 = yield self.connect()
+        client2 = yield self.connect()
+        yield client1.lock(u"res").writerAcquire()
+        pending = client1.lock(u"res").readerAcquire()
+        d = client2.lock(u"res").writerAcquire()
+        yield client2.lock(u"other").readerAcquire()
+        client1.transport.loseConnection()
+        yield self.assertFailure(pending, Exception)
+        yield d
+
+    @defer.inlineCallbacks
+    def testReleaseOtherClientLease(self):
+        client1 = yield self.connect()
+        client2 = yield self.connect()
+        leaseId = yield client1.acquire(u"res", u"write")
+        yield self.assertFailure(client2.callRemote(ReleaseLock, lease=leaseId), UnknownLeaseError)
+        d = client2.lock(u"res").writerAcquire()
+        yield client2.lock(u"other").readerAcquire()
+        self.assertNoResult(d)
+        yield client1.release(leaseId)
+        yield d
+
+
+class LockServerTestCase(TxTestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.server = LockServer(clock=self.clock, leaseTime=30.0)
+
+    def testRenew(self):
+        lease = self.successResultOf(self.server.acquire("owner1", u"res", u"write"))
+        self.clock.advance(20)
+        self.assertEqual(self.server.renew("owner1", [lease, 999]), [999])
+        # Another owner can neither renew nor release it
+        self.assertEqual(self.server.renew("owner2", [lease]), [lease])
+        self.assertRaises(UnknownLeaseError, self.server.release, "owner2", lease)
+        d = self.server.acquire("owner2", u"res", u"write")
+        self.clock.advance(20)
+        self.assertNoResult(d)
+        self.clock.advance(10)
+        self.successResultOf(d)
+
+    def testReleaseUnknownLease(self):
+        self.assertRaises(UnknownLeaseError, self.server.release, "owner1", 42)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from twisted.internet import task
+
+from txrwlock import TxReadersWriterLock
+from txrwlock import TxTestCase
+from txrwlock.stats import Histogram
+
+
+class HistogramTestCase(TxTestCase):
+
+    def testRecord(self):
+        histogram = Histogram(bounds=(1, 10))
+        for value in (0.5, 1, 5, 50):
+            histogram.record(value)
+        self.assertEqual([(1, 2), (10, 1), (float("inf"), 1)], histogram.buckets)
+        self.assertEqual(4, histogram.count)
+        self.assertEqual(50, histogram.max)
+        self.assertEqual(56.5 / 4, histogram.mean)
+
+
+class LockStatsTestCase(TxTestCase):
+
+    def testDisabledByDefault(self):
+        self.assertIsNone(TxReadersWriterLock().stats)
+
+    def testStats(self):
+        clock = task.Clock()
+        lock = TxReadersWriterLock(clock=clock, stats=True)
+        stats = lock.stats
+        lock.readerAcquire()
+        lock.readerAcquire()
+        dWriter = lock.writerAcquire()
+        dReaders = [lock.readerAcquire(), lock.readerAcquire()]
+        self.assertEqual(2, stats.readers)
+        self.assertEqual(1, stats.queuedWriters)
+        self.assertEqual(2, stats.queuedReaders)
+        clock.advance(2)
+        lock.readerReleaseNow()
+        lock.readerReleaseNow()
+        self.assertTrue(dWriter.called)
+        self.assertEqual(0, stats.queuedWriters)
+        self.assertEqual(2.0, stats.writeWaitTimes.max)
+        self.assertEqual(2.0, stats.readHoldTimes.max)
+        clock.advance(3)
+        lock.writerReleaseNow()
+        self.assertTrue(all(d.called for d in dReaders))
+        self.assertEqual(3.0, stats.writeHoldTimes.max)
+        self.assertEqual(5.0, stats.readWaitTimes.max)
+        self.assertEqual(0, stats.queuedReaders)
+        self.assertEqual(2, stats.peakQueuedReaders)
+        lock.readerReleaseNow()
+        lock.readerReleaseNow()
+        self.assertEqual(4, stats.readAcquisitions)
+        self.assertEqual(1, stats.writeAcquisitions)
+        self.assertEqual(2, stats.peakReaders)
+        self.assertEqual(0, stats.readers)
+
+    def testCancelledWaiter(self):
+        lock = TxReadersWriterLock(clock=task.Clock(), stats=True)
+        lock.writerAcquire()
+        lock.readerAcquire().addErrback(lambda _: None).cancel()
+        self.assertEqual(0, lock.stats.queuedReaders)
+        self.assertEqual(1, lock.stats.peakQueuedReaders)
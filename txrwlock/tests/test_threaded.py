@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+
+from twisted.internet import defer
+from twisted.internet import reactor
+from twisted.internet import task
+from twisted.internet import threads
+
+from txrwlock import BlockingReadersWriterLock
+from txrwlock import TxReadersWriterLock
+from txrwlock import TxTestCase
+
+
+def sleep(numSec):
+    return task.deferLater(reactor, numSec, lambda: None)
+
+
+class BlockingReadersWriterLockTestCase(TxTestCase):
+
+    @defer.inlineCallbacks
+    def testThreadReaderWaitsForReactorWriter(self):
+        lock = TxReadersWriterLock()
+        blockingLock = BlockingReadersWriterLock(lock)
+        events = []
+        yield lock.writerAcquire()
+
+        def threadRead():
+            with blockingLock.reading():
+                events.append("thread read")
+
+        d = threads.deferToThread(threadRead)
+        yield sleep(0.05)
+        events.append("reactor write")
+        lock.writerReleaseNow()
+        yield d
+        self.assertEqual(["reactor write", "thread read"], events)
+        # The release is marshalled to the reactor thread
+        yield sleep(0)
+        self.assertFalse(lock.isReading)
+
+    @defer.inlineCallbacks
+    def testReactorReaderWaitsForThreadWriter(self):
+        lock = TxReadersWriterLock()
+        blockingLock = BlockingReadersWriterLock(lock)
+        acquired = threading.Event()
+        proceed = threading.Event()
+
+        def threadWrite():
+            blockingLock.acquireWrite()
+            acquired.set()
+            proceed.wait(5)
+            blockingLock.releaseWrite()
+
+        d = threads.deferToThread(threadWrite)
+        yield threads.deferToThread(acquired.wait, 5)
+        self.assertTrue(lock.isWriting)
+        dReader = lock.readerAcquire()
+        self.assertFalse(dReader.called)
+        proceed.set()
+        yield d
+        yield dReader
+        lock.readerReleaseNow()
+
+    @defer.inlineCallbacks
+    def testForbiddenFromReactorThread(self):
+        yield sleep(0)  # Make sure the reactor is running
+        blockingLock = BlockingReadersWriterLock(TxReadersWriterLock())
+        self.assertRaises(RuntimeError, blockingLock.acquireRead)
+
+    @defer.inlineCallbacks
+    def testTimeout(self):
+        lock = TxReadersWriterLock()
+        blockingLock = BlockingReadersWriterLock(lock)
+        yield lock.writerAcquire()
+        yield self.assertFailure(
+            threads.deferToThread(blockingLock.acquireRead, timeout=0.01), defer.TimeoutError)
+        lock.writerReleaseNow()
@@ -9,6 +9,9 @@ from twisted.internet import defer
 from twisted.internet import reactor
 from twisted.internet import task
 
+from txrwlock import LockQueueFullError
+from txrwlock import PHASE_FAIR
+from txrwlock import READER_PREFERRING
 from txrwlock import TxReadersWriterLock
 from txrwlock import TxTestCase
 
@@ -19,7 +22,8 @@ def sleep(numSec):
     return task.deferLater(reactor, numSec, lambda: None)
 
 
-class TxReadersWriterLockTestCase(TxTestCase):
+# One test per feature of the lock
+class TxReadersWriterLockTestCase(TxTestCase):  # pylint: disable=too-many-public-methods
 
     shared_var = 0
 
@@ -102,3 +106,518 @@ class TxReadersWriterLockTestCase(TxTestCase):
 
         yield self.assertInlineCbRaises(Exception, raiseAfterReadAcquire)
         self.assertFalse(lock.isReading)
+
+    def testUncontendedAcquireIsSynchronous(self):
+        lock = TxReadersWriterLock()
+        d = lock.readerAcquire()
+        self.assertTrue(d.called)
+        self.assertTrue(lock.readerAcquire().called)
+        lock.readerRelease()
+        lock.readerRelease()
+        self.assertFalse(lock.isReading)
+        d = lock.writerAcquire()
+        self.assertTrue(d.called)
+        self.assertTrue(lock.isWriting)
+        lock.writerRelease()
+        self.assertFalse(lock.isWriting)
+
+    def testWaitingWriterBlocksNewReaders(self):
+        lock = TxReadersWriterLock()
+        lock.readerAcquire()
+        dWriter = lock.writerAcquire()
+        self.assertFalse(dWriter.called)
+        dReader = lock.readerAcquire()
+        self.assertFalse(dReader.called)
+        lock.readerRelease()
+        self.assertTrue(dWriter.called)
+        self.assertFalse(dReader.called)
+        lock.writerRelease()
+        self.assertTrue(dReader.called)
+        self.assertTrue(lock.isReading)
+        lock.readerRelease()
+        self.assertFalse(lock.isReading)
+
+    def testReleaseNow(self):
+        lock = TxReadersWriterLock()
+        lock.readerAcquire()
+        dWriter = lock.writerAcquire()
+        self.assertIsNone(lock.readerReleaseNow())
+        self.assertTrue(dWriter.called)
+        dReader = lock.readerAcquire()
+        self.assertIsNone(lock.writerReleaseNow())
+        self.assertTrue(dReader.called)
+        lock.readerReleaseNow()
+        self.assertFalse(lock.isReading)
+        self.assertFalse(lock.isWriting)
+
+    @defer.inlineCallbacks
+    def testContextManagers(self):
+        lock = TxReadersWriterLock()
+        section = lock.writer()
+        yield section.__aenter__()
+        self.assertTrue(lock.isWriting)
+        yield section.__aexit__(None, None, None)
+        self.assertFalse(lock.isWriting)
+        section = lock.reader()
+        yield section.__aenter__()
+        self.assertTrue(lock.isReading)
+        yield section.__aexit__(None, None, None)
+        self.assertFalse(lock.isReading)
+
+    @defer.inlineCallbacks
+    def testLockedDecorators(self):
+        lock = TxReadersWriterLock()
+
+        @lock.readLocked
+        def read(value):
+            self.assertTrue(lock.isReading)
+            return value
+
+        @lock.writeLocked
+        def write():
+            self.assertTrue(lock.isWriting)
+            return sleep(0.01).addCallback(lambda _: "written")
+
+        @lock.readLocked
+        def fail():
+            raise ValueError("Any exception")
+
+        dWrite = write()
+        dRead = read(42)
+        self.assertFalse(dRead.called)
+        result = yield defer.gatherResults([dWrite, dRead])
+        self.assertEqual(["written", 42], result)
+        yield self.assertFailure(fail(), ValueError)
+        self.assertFalse(lock.isReading)
+        self.assertFalse(lock.isWriting)
+
+    def testLockedDecoratorCancelledWhileWaiting(self):
+        lock = TxReadersWriterLock()
+        called = []
+        lock.writerAcquire()
+        d = lock.writeLocked(called.append)(1)
+        d.cancel()
+        self.failureResultOf(d, defer.CancelledError)
+        self.assertTrue(lock.isWriting)
+        lock.writerReleaseNow()
+        self.assertTrue(lock.isIdle)
+        # A reader of a readLocked call giving up does not drop another reader's hold
+        lock.readerAcquire()
+        dWriter = lock.writerAcquire()
+        d = lock.readLocked(called.append)(2)
+        d.cancel()
+        self.failureResultOf(d, defer.CancelledError)
+        self.assertNoResult(dWriter)
+        lock.readerReleaseNow()
+        self.successResultOf(dWriter)
+        lock.writerReleaseNow()
+        self.assertEqual(called, [])
+        self.assertTrue(lock.isIdle)
+
+    def testLockedDecoratorOnFullQueue(self):
+        lock = TxReadersWriterLock(maxQueuedReaders=0, maxQueuedWriters=0)
+        lock.writerAcquire()
+        self.failureResultOf(lock.writeLocked(lambda: None)(), LockQueueFullError)
+        self.failureResultOf(lock.readLocked(lambda: None)(), LockQueueFullError)
+        self.assertTrue(lock.isWriting)
+        lock.writerReleaseNow()
+        self.assertTrue(lock.isIdle)
+
+    def testQueuedReadersAdmittedInOneBatch(self):
+        lock = TxReadersWriterLock()
+        lock.writerAcquire()
+        admitted = []
+
+        def readAndRelease(_):
+            admitted.append(lock.isReading)
+            lock.readerReleaseNow()
+
+        for _ in range(10000):
+            lock.readerAcquire().addCallback(readAndRelease)
+        lock.writerReleaseNow()
+        self.assertEqual(10000, len(admitted))
+        self.assertTrue(all(admitted))
+        self.assertFalse(lock.isReading)
+        self.assertTrue(lock.writerAcquire().called)
+
+    def testQueuedWritersReleasingSynchronously(self):
+        lock = TxReadersWriterLock()
+        lock.readerAcquire()
+        order = []
+        ds = [lock.writeLocked(order.append)(i) for i in range(3000)]
+        for _ in range(3000):
+            ds.append(lock.writerAcquire().addCallback(lambda _: lock.writerReleaseNow()))
+        lock.readerReleaseNow()
+        for d in ds:
+            self.successResultOf(d)
+        self.assertEqual(order, list(range(3000)))
+        self.assertTrue(lock.isIdle)
+
+    def testAcquireTimeout(self):
+        clock = task.Clock()
+        lock = TxReadersWriterLock(clock=clock)
+        lock.readerAcquire()
+        dWriter = lock.writerAcquire(timeout=1)
+        dReader = lock.readerAcquire(timeout=5)
+        clock.advance(0.5)
+        self.assertFalse(dWriter.called)
+        self.assertFalse(dReader.called)
+        clock.advance(0.5)
+        self.failureResultOf(dWriter, defer.TimeoutError)
+        # The reader was only waiting for the timed out writer
+        self.successResultOf(dReader)
+        self.assertTrue(lock.isReading)
+        self.assertEqual([], clock.getDelayedCalls())
+        lock.readerReleaseNow()
+        lock.readerReleaseNow()
+        self.assertTrue(lock.writerAcquire().called)
+
+    def testAcquireCancellation(self):
+        lock = TxReadersWriterLock()
+        lock.writerAcquire()
+        dReader = lock.readerAcquire()
+        dWriter = lock.writerAcquire()
+        dReader.cancel()
+        self.failureResultOf(dReader, defer.CancelledError)
+        lock.writerReleaseNow()
+        self.successResultOf(dWriter)
+        dWriter.cancel()  # Too late, the lock is already held
+        self.assertTrue(lock.isWriting)
+        lock.writerReleaseNow()
+        self.assertFalse(lock.isWriting)
+        self.assertTrue(lock.readerAcquire().called)
+
+    def testTryAcquire(self):
+        lock = TxReadersWriterLock()
+        self.assertTrue(lock.tryReaderAcquire())
+        self.assertTrue(lock.tryReaderAcquire())
+        self.assertFalse(lock.tryWriterAcquire())
+        dWriter = lock.writerAcquire()
+        self.assertFalse(lock.tryReaderAcquire())
+        lock.readerReleaseNow()
+        lock.readerReleaseNow()
+        self.assertTrue(dWriter.called)
+        self.assertFalse(lock.tryWriterAcquire())
+        lock.writerReleaseNow()
+        self.assertTrue(lock.tryWriterAcquire())
+        lock.writerReleaseNow()
+        self.assertFalse(lock.isWriting)
+
+    def testUnknownPolicy(self):
+        self.assertRaises(ValueError, TxReadersWriterLock, policy="random")
+
+    def testReaderPreferringPolicy(self):
+        lock = TxReadersWriterLock(policy=READER_PREFERRING)
+        lock.readerAcquire()
+        dWriter = lock.writerAcquire()
+        self.assertTrue(lock.readerAcquire().called)
+        lock.readerReleaseNow()
+        self.assertFalse(dWriter.called)
+        lock.readerReleaseNow()
+        self.assertTrue(dWriter.called)
+        dReader = lock.readerAcquire()
+        self.assertFalse(dReader.called)
+        lock.writerReleaseNow()
+        self.assertTrue(dReader.called)
+        lock.readerReleaseNow()
+
+    def testPhaseFairPolicy(self):
+        lock = TxReadersWriterLock(policy=PHASE_FAIR)
+        lock.writerAcquire()
+        dReader1 = lock.readerAcquire()
+        dWriter = lock.writerAcquire()
+        dReader2 = lock.readerAcquire()
+        lock.writerReleaseNow()
+        # All the readers waiting for the writer are admitted before the next writer
+        self.assertTrue(dReader1.called)
+        self.assertTrue(dReader2.called)
+        self.assertFalse(dWriter.called)
+        # ... but new readers wait for the next writer
+        dReader3 = lock.readerAcquire()
+        self.assertFalse(dReader3.called)
+        lock.readerReleaseNow()
+        lock.readerReleaseNow()
+        self.assertTrue(dWriter.called)
+        self.assertFalse(dReader3.called)
+        lock.writerReleaseNow()
+        self.assertTrue(dReader3.called)
+        lock.readerReleaseNow()
+        self.assertFalse(lock.isReading)
+        self.assertFalse(lock.isWriting)
+
+    def testUpgradableReader(self):
+        lock = TxReadersWriterLock()
+        self.assertTrue(lock.upgradableAcquire().called)
+        self.assertTrue(lock.readerAcquire().called)
+        dUpgradable = lock.upgradableAcquire()
+        self.assertFalse(dUpgradable.called)
+        dWriter = lock.writerAcquire()
+        dUpgrade = lock.upgrade()
+        self.assertFalse(dUpgrade.called)
+        # The pending upgrade blocks new readers
+        dReader = lock.readerAcquire()
+        self.assertFalse(dReader.called)
+        lock.readerReleaseNow()
+        # The upgrade goes before the waiting writer
+        self.assertTrue(dUpgrade.called)
+        self.assertFalse(dWriter.called)
+        self.assertTrue(lock.isWriting)
+        lock.writerReleaseNow()
+        self.assertTrue(dWriter.called)
+        lock.writerReleaseNow()
+        self.assertTrue(dReader.called)
+        self.assertTrue(dUpgradable.called)
+        self.assertTrue(lock.tryUpgrade() is False)
+        lock.readerReleaseNow()
+        self.assertTrue(lock.tryUpgrade())
+        lock.writerReleaseNow()
+        self.assertFalse(lock.isReading)
+        self.assertFalse(lock.isWriting)
+
+    def testUpgradableRelease(self):
+        lock = TxReadersWriterLock()
+        lock.upgradableAcquire()
+        dUpgradable = lock.upgradableAcquire()
+        lock.upgradableReleaseNow()
+        self.assertTrue(dUpgradable.called)
+        lock.upgradableReleaseNow()
+        self.assertTrue(lock.writerAcquire().called)
+        lock.writerReleaseNow()
+        lock.readerAcquire()
+        self.assertRaises(RuntimeError, lock.upgrade)
+        lock.readerReleaseNow()
+
+    def testUpgradeTimeout(self):
+        clock = task.Clock()
+        lock = TxReadersWriterLock(clock=clock)
+        lock.upgradableAcquire()
+        lock.readerAcquire()
+        dUpgrade = lock.upgrade(timeout=1)
+        dReader = lock.readerAcquire()
+        clock.advance(1)
+        self.failureResultOf(dUpgrade, defer.TimeoutError)
+        self.assertTrue(dReader.called)
+        lock.readerReleaseNow()
+        lock.readerReleaseNow()
+        self.assertTrue(lock.tryUpgrade())
+        lock.writerReleaseNow()
+
+    def testCancelledUpgradeReadmitsReaders(self):
+        # Readers only blocked by the pending upgrade enter when it is cancelled, even though a
+        # writer waits: with the reader-preferring policy...
+        lock = TxReadersWriterLock(policy=READER_PREFERRING)
+        lock.upgradableAcquire()
+        lock.readerAcquire()
+        dWriter = lock.writerAcquire()
+        dUpgrade = lock.upgrade()
+        dReader = lock.readerAcquire()
+        dUpgrade.cancel()
+        self.failureResultOf(dUpgrade, defer.CancelledError)
+        self.successResultOf(dReader)
+        self.assertNoResult(dWriter)
+        # ... and when they outrank the waiting writer
+        lock = TxReadersWriterLock()
+        lock.upgradableAcquire()
+        lock.readerAcquire()
+        dWriter = lock.writerAcquire()
+        dUpgrade = lock.upgrade()
+        dReader = lock.readerAcquire(priority=1)
+        dUpgrade.cancel()
+        self.failureResultOf(dUpgrade, defer.CancelledError)
+        self.successResultOf(dReader)
+        self.assertNoResult(dWriter)
+        lock.readerReleaseNow()
+        lock.readerReleaseNow()
+        lock.upgradableReleaseNow()
+        self.successResultOf(dWriter)
+
+    def testDowngrade(self):
+        lock = TxReadersWriterLock()
+        self.assertRaises(RuntimeError, lock.downgrade)
+        lock.writerAcquire()
+        dReaders = [lock.readerAcquire(), lock.readerAcquire()]
+        dWriter = lock.writerAcquire()
+        self.assertIsNone(lock.downgrade())
+        self.assertTrue(all(d.called for d in dReaders))
+        self.assertFalse(dWriter.called)
+        lock.readerReleaseNow()
+        lock.readerReleaseNow()
+        self.assertFalse(dWriter.called)
+        lock.readerReleaseNow()
+        self.assertTrue(dWriter.called)
+        lock.writerReleaseNow()
+        self.assertFalse(lock.isWriting)
+        self.assertFalse(lock.isReading)
+
+    def testOptimisticRead(self):
+        lock = TxReadersWriterLock()
+        stamp = lock.tryOptimisticRead()
+        self.assertEqual(stamp, 0)
+        self.assertTrue(lock.validate(stamp))
+        lock.readerAcquire()
+        self.assertTrue(lock.validate(stamp))
+        lock.readerReleaseNow()
+        lock.writerAcquire()
+        self.assertFalse(lock.validate(stamp))
+        self.assertIsNone(lock.tryOptimisticRead())
+        lock.writerReleaseNow()
+        self.assertEqual(lock.version, 1)
+        self.assertFalse(lock.validate(stamp))
+        self.assertTrue(lock.validate(lock.tryOptimisticRead()))
+
+    def testOptimisticReadFallsBackToReadLock(self):
+        lock = TxReadersWriterLock()
+        data = {"key": "old"}
+        d = lock.optimisticRead(data.get, "key")
+        self.assertEqual(self.successResultOf(d), "old")
+        self.assertFalse(lock.isReading)
+        lock.writerAcquire()
+        d = lock.optimisticRead(data.get, "key")
+        self.assertNoResult(d)
+        data["key"] = "new"
+        lock.writerReleaseNow()
+        self.assertEqual(self.successResultOf(d), "new")
+        self.assertTrue(lock.isIdle)
+        self.failureResultOf(lock.optimisticRead(data.__getitem__, "missing"), KeyError)
+
+    def testSubmitWrite(self):
+        lock = TxReadersWriterLock()
+        self.assertEqual(self.successResultOf(lock.submitWrite(lambda: 42)), 42)
+        self.assertTrue(lock.isIdle)
+
+    def testSubmitWriteBatch(self):
+        lock = TxReadersWriterLock(stats=True)
+        lock.readerAcquire()
+        order = []
+        pending = defer.Deferred()
+        d1 = lock.submitWrite(order.append, 1)
+        d2 = lock.submitWrite(lambda: pending.addCallback(lambda _: order.append(2)))
+        d3 = lock.submitWrite(lambda: 1 // 0)
+        d4 = lock.submitWrite(order.append, 4)
+        d5 = lock.submitWrite(order.append, 5)
+        d4.cancel()
+        dReader = lock.readerAcquire()
+        lock.readerReleaseNow()
+        self.assertEqual(order, [1])
+        self.assertTrue(lock.isWriting)
+        # Results are delivered once the whole batch has run
+        self.assertNoResult(d1)
+        d6 = lock.submitWrite(order.append, 6)
+        pending.callback(None)
+        self.assertEqual(order, [1, 2, 5, 6])
+        self.successResultOf(d1)
+        self.successResultOf(d2)
+        self.failureResultOf(d3, ZeroDivisionError)
+        self.failureResultOf(d4, defer.CancelledError)
+        self.successResultOf(d5)
+        self.successResultOf(d6)
+        self.successResultOf(dReader)
+        self.assertEqual(lock.stats.writeAcquisitions, 2)
+
+    def testBoundedQueues(self):
+        saturated = []
+        lock = TxReadersWriterLock(stats=True, maxQueuedReaders=2, maxQueuedWriters=1,
+                                   onSaturated=saturated.append)
+        lock.writerAcquire()
+        readers = [lock.readerAcquire(), lock.upgradableAcquire()]
+        self.failureResultOf(lock.readerAcquire(), LockQueueFullError)
+        self.failureResultOf(lock.upgradableAcquire(), LockQueueFullError)
+        writer = lock.writerAcquire()
+        self.failureResultOf(lock.writerAcquire(), LockQueueFullError)
+        self.failureResultOf(lock.submitWrite(lambda: None), LockQueueFullError)
+        self.assertEqual(saturated, ["reader", "reader", "writer", "writer"])
+        self.assertEqual(lock.stats.rejectedReaders, 2)
+        self.assertEqual(lock.stats.rejectedWriters, 2)
+        lock.writerReleaseNow()
+        self.successResultOf(writer)
+        self.assertTrue(lock.isWriting)
+        lock.writerReleaseNow()
+        for d in readers:
+            self.successResultOf(d)
+        # Requests granted immediately are never refused
+        self.successResultOf(lock.readerAcquire())
+
+    def testWriterPriorities(self):
+        lock = TxReadersWriterLock()
+        lock.writerAcquire()
+        order = []
+
+        def write(name, priority):
+            d = lock.writerAcquire(priority=priority)
+            d.addCallback(lambda _: order.append(name))
+            return d
+
+        write("bulk1", 0)
+        write("bulk2", 0)
+        cancelled = write("cancelled", 5)
+        write("admin", 5)
+        write("background", -1)
+        cancelled.cancel()
+        self.failureResultOf(cancelled, defer.CancelledError)
+        for _ in range(5):
+            lock.writerReleaseNow()
+        self.assertEqual(order, ["admin", "bulk1", "bulk2", "background"])
+
+    def testPriorityAging(self):
+        lock = TxReadersWriterLock()
+        lock.writerAcquire()
+        order = []
+        lock.writerAcquire(priority=-1).addCallback(lambda _: order.append("old"))
+        for i in range(lock.priorityAging + 1):
+            lock.writerAcquire().addCallback(lambda _, i=i: order.append(i))
+        for _ in range(lock.priorityAging + 2):
+            lock.writerReleaseNow()
+        # Overtaken by newer writers, but not by more than priorityAging of them
+        self.assertGreater(order.index("old"), 0)
+        self.assertLessEqual(order.index("old"), lock.priorityAging)
+
+    def testReaderPriorities(self):
+        lock = TxReadersWriterLock()
+        lock.readerAcquire()
+        dWriter = lock.writerAcquire()
+        self.assertNoResult(lock.readerAcquire())
+        # Passes the waiting writer
+        self.successResultOf(lock.readerAcquire(priority=1))
+        lock.readerReleaseNow()
+        lock.readerReleaseNow()
+        self.successResultOf(dWriter)
+        dBulkWriter = lock.writerAcquire()
+        dUrgentReader = lock.readerAcquire(priority=1)
+        lock.writerReleaseNow()
+        # Admitted with the other waiting readers, before the next writer
+        self.successResultOf(dUrgentReader)
+        self.assertNoResult(dBulkWriter)
+        self.assertTrue(lock.isWriting)
+
+    def testReleaseWithoutHolding(self):
+        lock = TxReadersWriterLock()
+        self.assertRaises(RuntimeError, lock.readerReleaseNow)
+        self.assertRaises(RuntimeError, lock.writerReleaseNow)
+        self.assertRaises(RuntimeError, lock.upgradableReleaseNow)
+        lock.readerAcquire()
+        lock.readerReleaseNow()
+        self.assertRaises(RuntimeError, lock.readerReleaseNow)
+        lock.writerAcquire()
+        self.assertRaises(RuntimeError, lock.readerReleaseNow)
+        lock.writerReleaseNow()
+        self.assertRaises(RuntimeError, lock.writerReleaseNow)
+        self.assertTrue(lock.isIdle)
+
+    def testQueuesDroppedWhenWaitersGiveUp(self):
+        clock = task.Clock()
+        lock = TxReadersWriterLock(clock=clock)
+        lock.writerAcquire()
+        dReader = lock.readerAcquire(timeout=1)
+        dUpgradable = lock.upgradableAcquire()
+        dWriter = lock.writerAcquire(priority=1)
+        clock.advance(1)
+        dUpgradable.cancel()
+        dWriter.cancel()
+        for d in (dReader, dUpgradable, dWriter):
+            self.failureResultOf(d)
+        # pylint: disable=protected-access
+        self.assertIsNone(lock._ReadersWriterLockBase__rdrs_q)
+        self.assertIsNone(lock._ReadersWriterLockBase__upg_q)
+        self.assertIsNone(lock._ReadersWriterLockBase__wrtrs_q)
+        lock.writerReleaseNow()
+        self.assertTrue(lock.isIdle)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Access to a Twisted Readers/Writer Lock from worker threads
+# License:
+#   MIT License
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+
+from twisted.internet import threads
+from twisted.python import threadable
+
+__all__ = ["BlockingReadersWriterLock"]
+
+
+class BlockingReadersWriterLock(object):
+    '''
+    Blocking, thread-side access to a ``TxReadersWriterLock``.
+
+    ``TxReadersWriterLock`` must only be used from the reactor thread. This wrapper lets worker
+    threads (e.g., code run with ``deferToThread``) take part in the same readers/writer protocol
+    as the reactor-side holders: every call is marshalled to the reactor thread with
+    ``callFromThread``, and ``acquireRead``/``acquireWrite`` block the calling thread until the
+    lock has been granted.
+
+    Do **NOT** call these methods from the reactor thread itself, it would block the reactor
+    forever: they raise ``RuntimeError`` instead.
+
+    .. code-block:: python
+
+        from twisted.internet import threads
+        from txrwlock import BlockingReadersWriterLock
+
+        rwlocker = TxReadersWriterLock()
+        blockingLock = BlockingReadersWriterLock(rwlocker)
+
+        def heavyRead():
+            # Runs in the thread pool
+            with blockingLock.reading():
+                # ... CPU-heavy treatment of the share ...
+
+        threads.deferToThread(heavyRead)
+    '''
+
+    def __init__(self, lock, reactor=None):
+        if reactor is None:
+            from twisted.internet import reactor
+        self.__lock = lock
+        self.__reactor = reactor
+
+    def __blockingCall(self, func, *args, **kwargs):
+        if threadable.isInIOThread():
+            raise RuntimeError("Blocking lock acquisition called from the reactor thread")
+        return threads.blockingCallFromThread(self.__reactor, func, *args, **kwargs)
+
+    def acquireRead(self, timeout=None):
+        '''
+        Block the calling thread until the lock is acquired for a Reader.
+
+        Raises ``defer.TimeoutError`` if it could not be acquired after ``timeout`` seconds.
+        '''
+        self.__blockingCall(self.__lock.readerAcquire, timeout=timeout)
+
+    def releaseRead(self):
+        '''
+        Release the lock by a Reader. Does not block.
+        '''
+        self.__reactor.callFromThread(self.__lock.readerReleaseNow)
+
+    def acquireWrite(self, timeout=None):
+        '''
+        Block the calling thread until the lock is acquired for a Writer.
+
+        Raises ``defer.TimeoutError`` if it could not be acquired after ``timeout`` seconds.
+        '''
+        self.__blockingCall(self.__lock.writerAcquire, timeout=timeout)
+
+    def releaseWrite(self):
+        '''
+        Release the lock by a Writer. Does not block.
+        '''
+        self.__reactor.callFromThread(self.__lock.writerReleaseNow)
+
+    @contextlib.contextmanager
+    def reading(self, timeout=None):
+        '''
+        Context manager holding the lock for a Reader.
+        '''
+        self.acquireRead(timeout=timeout)
+        try:
+            yield
+        finally:
+            self.releaseRead()
+
+    @contextlib.contextmanager
+    def writing(self, timeout=None):
+        '''
+        Context manager holding the lock for a Writer.
+        '''
+        self.acquireWrite(timeout=timeout)
+        try:
+            yield
+        finally:
+            self.releaseWrite()
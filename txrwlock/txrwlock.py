@@ -8,45 +8,50 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import functools
+
 from twisted.internet import defer
+from twisted.python import failure
+
+from . import debug as _debug
+from .base import PHASE_FAIR
+from .base import READER_PREFERRING
+from .base import WRITER_PREFERRING
+from .base import LockQueueFullError
+from .base import _ReadersWriterLockBase
+from .stats import LockStats
+
+__all__ = [
+    "LockQueueFullError",
+    "PHASE_FAIR",
+    "READER_PREFERRING",
+    "TxReadersWriterLock",
+    "WRITER_PREFERRING",
+]
+
+
+class _DeferredSection(object):
+    '''
+    Asynchronous context manager holding one side of a ``TxReadersWriterLock``.
 
-__all__ = ["TxReadersWriterLock"]
+    ``__aenter__`` and ``__aexit__`` directly return the lock deferreds, which are awaitable, so no
+    coroutine frame is added around them.
+    '''
 
+    __slots__ = ('__acquire', '__release')
+
+    def __init__(self, acquire, release):
+        self.__acquire = acquire
+        self.__release = release
+
+    def __aenter__(self):
+        return self.__acquire()
+
+    def __aexit__(self, excType, excValue, traceback):
+        return self.__release()
 
-class _LightSwitch(object):
-    '''
-    An auxiliary "light switch"-like object. The first deferred turns on the "switch", the
-    last one turns it off.
-    '''
 
-    def __init__(self):
-        self.__cnt = 0
-        self.__m = defer.DeferredLock()
-
-    @defer.inlineCallbacks
-    def acquire(self, lock):
-        '''
-        Acquire the lock and increase the counter
-        '''
-        yield self.__m.acquire()
-        self.__cnt += 1
-        if self.__cnt == 1:
-            yield lock.acquire()
-        self.__m.release()
-
-    @defer.inlineCallbacks
-    def release(self, lock):
-        '''
-        Release the lock and decreaser the counter
-        '''
-        yield self.__m.acquire()
-        self.__cnt -= 1
-        if self.__cnt == 0:
-            lock.release()
-        self.__m.release()
-
-
-class TxReadersWriterLock(object):
+class TxReadersWriterLock(_ReadersWriterLockBase):
     '''
     Readers-Writer Lock for Twisted's Deferred
 
@@ -68,7 +73,9 @@ class TxReadersWriterLock(object):
     - "Readers" uses ``readerAcquire`` and ``readerRelease``.
     - "Writer" uses ``writerAcquire`` and ``writerRelease``.
 
-    .. Python version > 3.5 can also use `async with reader`
+    Python 3.5+ coroutines (run with ``defer.ensureDeferred``) can use ``async with reader()``
+    and ``async with writer()``, and Deferred-returning functions can be wrapped with the
+    ``readLocked`` and ``writeLocked`` decorators.
 
     A "reader" is not blocked when one, two or more 'reads' are being executed.
 
@@ -82,7 +89,8 @@ class TxReadersWriterLock(object):
         Please be aware than ``TxReadersWriterLock.acquire*`` and
         ``TxReadersWriterLock.release*`` methods are deferred, which is different from
         ``defer.DeferredLock``, where only the ``defer.DeferredLock.acquire()`` method is a
-        deferred.
+        deferred. ``readerReleaseNow`` and ``writerReleaseNow`` are synchronous release variants
+        that follow the ``defer.DeferredLock.release()`` semantics.
 
     **Usage**
 
@@ -151,31 +159,153 @@ class TxReadersWriterLock(object):
     ``MySharedObject.changeDataValue`` is called, all new call to
     ``performHeavyTreatmentOnData`` are blocked.
 
+    **Fairness**
+
+    By default the lock gives priority to writers (``WRITER_PREFERRING``). The ``policy`` argument
+    accepts ``READER_PREFERRING`` (writers only wait for the ongoing readers, but may starve) or
+    ``PHASE_FAIR`` (read and write phases alternate: a writer releasing the lock admits all the
+    readers waiting for it before the next writer, which bounds both reader and writer waits).
+
+    **Upgradable reads**
+
+    A reader that may have to modify the share after having read it can use
+    ``upgradableAcquire``. At most one upgradable reader holds the lock at a time, alongside plain
+    readers, and it can ``upgrade`` to a writer without releasing the lock: no other writer can
+    modify the share in between, so what has been read stays valid.
+
+    .. code-block:: python
+
+        @defer.inlineCallbacks
+        def refresh(self):
+            yield rwlocker.upgradableAcquire()
+            if not self.isStale():
+                rwlocker.upgradableReleaseNow()
+                return
+            yield rwlocker.upgrade()
+            try:
+                # ... update the share ...
+            finally:
+                rwlocker.writerReleaseNow()
+
+    A writer can also ``downgrade`` to a plain reader, which admits the waiting readers at once:
+
+    .. code-block:: python
+
+        @defer.inlineCallbacks
+        def publish(self, snapshot):
+            yield rwlocker.writerAcquire()
+            self._snapshot = snapshot
+            rwlocker.downgrade()
+            try:
+                yield self.serve(self._snapshot)
+            finally:
+                rwlocker.readerReleaseNow()
+
+    **Priorities**
+
+    ``readerAcquire`` and ``writerAcquire`` accept a ``priority`` (an integer, ``0`` by default,
+    higher is served first) to let latency-critical requests pass bulk ones:
+
+    - waiting writers are served by decreasing priority, in arrival order among equals;
+    - a reader with a higher priority than the next waiting writer is not blocked by the waiting
+      writers, and is admitted (with all the waiting readers) before that writer.
+
+    To prevent starvation, waiters age: a waiter can only be overtaken by the next
+    ``priorityAging`` (16) requests per priority level of difference. Without priorities, the
+    queues stay plain FIFO deques.
+
+    .. code-block:: python
+
+        yield rwlocker.writerAcquire(priority=10)  # admin write, ahead of the batch jobs
+
+    **Write batches**
+
+    Bursts of small writes can be handed over with ``submitWrite``: all the writes submitted while
+    the lock is busy are then run in a single writer tenure, and readers are stalled once for the
+    whole batch:
+
+    .. code-block:: python
+
+        def ingest(self, record):
+            return rwlocker.submitWrite(self._table.__setitem__, record.key, record)
+
+    **Optimistic reads**
+
+    Short synchronous read sections, which never yield, can skip the lock altogether: the lock
+    counts the completed write sections in ``version``, so a reader takes a stamp with
+    ``tryOptimisticRead``, reads, and checks with ``validate`` that no writer held the lock in the
+    meantime. ``optimisticRead`` does that and falls back to a locked read when needed:
+
+    .. code-block:: python
+
+        def lookup(self, key):
+            return rwlocker.optimisticRead(self._table.get, key)
+
+    **Timeouts**
+
+    ``readerAcquire`` and ``writerAcquire`` accept a ``timeout`` (in seconds) after which the
+    returned deferred fails with ``defer.TimeoutError``. Delays are scheduled on ``clock`` (any
+    ``IReactorTime`` provider, the global reactor by default). Cancelling the returned deferred
+    removes the request from the waiting queue as well.
+
+    **Backpressure**
+
+    The waiting queues are unbounded by default. With ``maxQueuedReaders`` (counting the
+    upgradable readers too) or ``maxQueuedWriters``, a request that cannot be granted immediately
+    while that many requests of its kind already wait fails at once with ``LockQueueFullError``,
+    shedding the load at the lock. ``onSaturated`` is then called with ``"reader"`` or
+    ``"writer"``, to observe the saturation:
+
+    .. code-block:: python
+
+        rwlocker = TxReadersWriterLock(maxQueuedReaders=1000, maxQueuedWriters=10,
+                                       onSaturated=lambda role: metrics.increment(role))
+
+    **Statistics**
+
+    With ``stats=True``, the ``stats`` property gives a ``LockStats`` with acquisition counters,
+    reader and queue depths, and wait/hold time histograms measured with ``clock``. Without it,
+    the lock only pays a ``None`` check per operation.
+
+    **Debugging**
+
+    Releasing a lock which is not held raises ``RuntimeError``. With ``debug=True``, or for all the
+    locks created after ``txrwlock.debug.enable()`` (or with the ``TXRWLOCK_DEBUG`` environment
+    variable set), the lock also records where it has been acquired and awaited from, logs the
+    tasks requesting a lock they already hold (self-deadlocks) or releasing it twice, while
+    another task holds it (double releases), and ``txrwlock.debug.dumpLocks()`` describes all the
+    held and awaited locks. ``stats`` is then a ``debug.DebugLockStats``.
+
     '''
 
-    def __init__(self):
-        self.__rd_swtch = _LightSwitch()
-        self.__wrte_swtch = _LightSwitch()
-        self.__no_rdr = defer.DeferredLock()
-        self.__no_wrtr = defer.DeferredLock()
-        self.__rdrs_q = defer.DeferredLock()
-
-    @property
-    def isReading(self):
-        '''
-        Is the lock acquired for read? (will return false if only required for writer)
-        '''
-        return self.__no_wrtr.locked and not self.__no_rdr.locked
-
-    @property
-    def isWriting(self):
-        '''
-        Is the lock acquired for write?
-        '''
-        return self.__no_rdr.locked
-
-    @defer.inlineCallbacks
-    def readerAcquire(self):
+    __slots__ = ('__clock', '__batch')
+
+    # All the options have a default value, and are meant to be passed by keyword
+    def __init__(self,  # pylint: disable=too-many-arguments
+                 clock=None,
+                 stats=False,
+                 policy=WRITER_PREFERRING,
+                 maxQueuedReaders=None,
+                 maxQueuedWriters=None,
+                 onSaturated=None,
+                 debug=None):
+        if debug is None:
+            debug = _debug.isEnabled()
+        if debug:
+            stats = _debug.DebugLockStats(self.__seconds, self)
+        else:
+            stats = LockStats(self.__seconds) if stats else None
+        super(TxReadersWriterLock, self).__init__(
+            stats=stats,
+            policy=policy,
+            maxQueuedReaders=maxQueuedReaders,
+            maxQueuedWriters=maxQueuedWriters,
+            onSaturated=onSaturated)
+        self.__clock = clock
+        # Writes submitted with submitWrite, waiting for the writer lock, None if there are none
+        self.__batch = None
+
+    def readerAcquire(self, timeout=None, priority=0):
         """
         Deferred to acquire the lock for a Reader.
 
@@ -185,6 +315,15 @@ class TxReadersWriterLock(object):
         If the lock has been requested by at least one writer, even if this writer is waiting for
         all ongoing readers to finish, this call will be blocked.
 
+        When no writer holds or waits for the lock, the returned deferred has already fired: no
+        waiter is allocated and the caller resumes synchronously.
+
+        If the lock could not be acquired after ``timeout`` seconds, the deferred fails with
+        ``defer.TimeoutError``. It can also be cancelled while waiting.
+
+        A reader with a ``priority`` higher than the next waiting writer's passes the waiting
+        writers (see **Priorities**).
+
         You need to enclose this call inside try/finally to ensure the lock is always released, even
         in case of exception.
 
@@ -200,26 +339,23 @@ class TxReadersWriterLock(object):
                 finally:
                     yield rwlocker.readerRelease()
         """
+        if self.tryReaderAcquire(priority):
+            return defer.succeed(None)
+        return self.__wait(self._readerEnqueue, timeout, priority)
 
-        yield self.__rdrs_q.acquire()
-        yield self.__no_rdr.acquire()
-        yield self.__rd_swtch.acquire(self.__no_wrtr)
-        self.__no_rdr.release()
-        self.__rdrs_q.release()
-
-    @defer.inlineCallbacks
     def readerRelease(self):
         """
         Release the lock by a reader.
 
         Inside an inlineCallback, you need to yield this call.
 
-        This call is always non-blocking.
+        This call is always non-blocking. See ``readerReleaseNow`` for a variant that does not
+        allocate a deferred.
         """
-        yield self.__rd_swtch.release(self.__no_wrtr)
+        self.readerReleaseNow()
+        return defer.succeed(None)
 
-    @defer.inlineCallbacks
-    def writerAcquire(self):
+    def writerAcquire(self, timeout=None, priority=0):
         """
         Acquire the lock for a Writer.
 
@@ -229,6 +365,14 @@ class TxReadersWriterLock(object):
         will wait for all reader to finish. If two writers request access to the lock, each one will
         wait so only one write has the lock at the a time.
 
+        When the lock is free, the returned deferred has already fired.
+
+        If the lock could not be acquired after ``timeout`` seconds, the deferred fails with
+        ``defer.TimeoutError``. It can also be cancelled while waiting, which unblocks the readers
+        that were only waiting for this writer.
+
+        Waiting writers are served by decreasing ``priority`` (see **Priorities**).
+
         You need to enclose this call inside try/finally to ensure the lock is always released, even
         in case of exception.
 
@@ -244,18 +388,259 @@ class TxReadersWriterLock(object):
                 finally:
                     yield rwlocker.writerRelease()
         """
+        if self.tryWriterAcquire():
+            return defer.succeed(None)
+        return self.__wait(self._writerEnqueue, timeout, priority)
 
-        yield self.__wrte_swtch.acquire(self.__no_rdr)
-        yield self.__no_wrtr.acquire()
-
-    @defer.inlineCallbacks
     def writerRelease(self):
         """
         Release the lock by a Writer.
 
         Inside an inlineCallback, you need to yield this call.
 
-        This call is always non-blocking
+        This call is always non-blocking. See ``writerReleaseNow`` for a variant that does not
+        allocate a deferred.
+        """
+        self.writerReleaseNow()
+        return defer.succeed(None)
+
+    def upgradableAcquire(self, timeout=None):
+        """
+        Acquire the lock for the upgradable Reader.
+
+        Like ``readerAcquire``, but only one upgradable reader can hold the lock at a time (plain
+        readers are not blocked by it). Release it with ``upgradableRelease``, or call
+        ``upgrade`` and then release the write lock with ``writerRelease``.
+        """
+        if self.tryUpgradableAcquire():
+            return defer.succeed(None)
+        return self.__wait(self._upgradableEnqueue, timeout)
+
+    def upgradableRelease(self):
+        """
+        Release the lock by the upgradable Reader.
+
+        This call is always non-blocking. See ``upgradableReleaseNow`` for a variant that does not
+        allocate a deferred.
+        """
+        self.upgradableReleaseNow()
+        return defer.succeed(None)
+
+    def upgrade(self, timeout=None):
+        """
+        Turn the upgradable read lock held by the caller into a write lock.
+
+        New readers are blocked, and the returned deferred fires once the other readers have
+        released the lock; the upgrade goes before any writer already waiting. The caller then
+        holds the lock as a Writer and releases it with ``writerRelease``.
+
+        On timeout or cancellation, the caller is still the upgradable reader.
+        """
+        if self.tryUpgrade():
+            return defer.succeed(None)
+        return self.__wait(self._upgradeEnqueue, timeout)
+
+    def reader(self):
+        """
+        Asynchronous context manager holding the lock for a Reader.
+
+        Example:
+
+        .. code-block:: python
+
+            async def aReaderMethod(...):
+                async with rwlocker.reader():
+                    # ... any treatment ...
+        """
+        return _DeferredSection(self.readerAcquire, self.readerRelease)
+
+    def writer(self):
+        """
+        Asynchronous context manager holding the lock for a Writer.
+
+        Example:
+
+        .. code-block:: python
+
+            async def aWriterMethod(...):
+                async with rwlocker.writer():
+                    # ... any treatment ...
+        """
+        return _DeferredSection(self.writerAcquire, self.writerRelease)
+
+    def submitWrite(self, func, *args, **kwargs):
+        """
+        Run ``func(*args, **kwargs)`` with the lock held by a Writer.
+
+        The writes submitted while the lock is busy are run back-to-back, in submission order,
+        during a single writer tenure: readers are drained once for the whole batch instead of once
+        per write. When ``func`` returns a deferred, the next write waits for it.
+
+        Returns a deferred firing with the result (or failure) of ``func``, once the lock has been
+        released. Cancelling it before its write has started drops the write.
+        """
+
+        def cancel(d):
+            if self.__batch is not None:
+                self.__batch[:] = [w for w in self.__batch if w[3] is not d]
+
+        d = defer.Deferred(cancel)
+        if self.__batch is None:
+            self.__batch = [(func, args, kwargs, d)]
+            self.writerAcquire().addCallbacks(self.__runBatch, self.__failBatch)
+        else:
+            self.__batch.append((func, args, kwargs, d))
+        return d
+
+    def __failBatch(self, reason):
+        batch, self.__batch = self.__batch, None
+        for _func, _args, _kwargs, d in batch:
+            if not d.called:
+                d.errback(reason)
+
+    def __runBatch(self, _):
+        # Writes submitted from now on go to the next batch
+        batch, self.__batch = self.__batch, None
+        results = []
+        state = {"waiting": False}
+
+        def collected(result):
+            results.append(result)
+            if state["waiting"]:
+                state["waiting"] = False
+                runNext()
+
+        def runNext():
+            while len(results) < len(batch):
+                func, args, kwargs, d = batch[len(results)]
+                if d.called:
+                    results.append(None)
+                    continue
+                try:
+                    result = func(*args, **kwargs)
+                except Exception:  # pylint: disable=broad-except
+                    result = failure.Failure()
+                if not isinstance(result, defer.Deferred):
+                    results.append(result)
+                    continue
+                index = len(results)
+                result.addBoth(collected)
+                if len(results) == index:
+                    state["waiting"] = True
+                    return
+            self.writerReleaseNow()
+            for (_func, _args, _kwargs, d), result in zip(batch, results):
+                if d.called:
+                    continue
+                if isinstance(result, failure.Failure):
+                    d.errback(result)
+                else:
+                    d.callback(result)
+
+        runNext()
+
+    def optimisticRead(self, func, *args, **kwargs):
+        """
+        Run the synchronous ``func`` without acquiring the lock, unless a writer holds it.
+
+        ``func`` is called between ``tryOptimisticRead`` and ``validate``. If the read turns out
+        to be invalid (a writer holds the lock, or wrote in between), it is called again with the
+        lock held by a Reader. Returns a deferred firing with the result of the valid call, which
+        has already fired on the optimistic path.
+        """
+        stamp = self.tryOptimisticRead()
+        if stamp is not None:
+            try:
+                result = func(*args, **kwargs)
+            except Exception:  # pylint: disable=broad-except
+                if self.validate(stamp):
+                    return defer.fail()
+            else:
+                if self.validate(stamp):
+                    return defer.succeed(result)
+        return self.readLocked(func)(*args, **kwargs)
+
+    def readLocked(self, func):
+        """
+        Decorator running a function (synchronous or returning a deferred) with the lock held by a
+        Reader.
+
+        The decorated function always returns a deferred, the lock is released once it has fired,
+        even in case of failure.
+
+        Example:
+
+        .. code-block:: python
+
+            @rwlocker.readLocked
+            def aReaderMethod(...):
+                # ... any treatment ...
+        """
+        return self.__locked(func, self.tryReaderAcquire, self.readerAcquire,
+                             self.readerReleaseNow)
+
+    def writeLocked(self, func):
+        """
+        Decorator running a function (synchronous or returning a deferred) with the lock held by a
+        Writer.
+
+        The decorated function always returns a deferred, the lock is released once it has fired,
+        even in case of failure.
         """
-        self.__no_wrtr.release()
-        yield self.__wrte_swtch.release(self.__no_rdr)
+        return self.__locked(func, self.tryWriterAcquire, self.writerAcquire,
+                             self.writerReleaseNow)
+
+    @staticmethod
+    def __locked(func, tryAcquire, acquire, release):
+
+        def releaseAndPassThrough(result):
+            release()
+            return result
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            def run(_):
+                return defer.maybeDeferred(func, *args, **kwargs).addBoth(releaseAndPassThrough)
+
+            if tryAcquire():
+                return run(None)
+            # The lock is only released once granted: the acquisition itself may fail (timeout,
+            # cancellation, full queue)
+            return acquire().addCallback(run)
+
+        return wrapper
+
+    def __wait(self, enqueue, timeout, *enqueueArgs):
+        d = defer.Deferred(self._removeWaiter)
+        try:
+            enqueue(d, *enqueueArgs)
+        except LockQueueFullError:
+            return defer.fail()
+        if timeout is not None:
+            timeoutCall = self.__getClock().callLater(timeout, self.__timeoutWaiter, d, timeout)
+            d.addBoth(self.__cancelTimeout, timeoutCall)
+        return d
+
+    def __getClock(self):
+        if self.__clock is None:
+            from twisted.internet import reactor
+            self.__clock = reactor
+        return self.__clock
+
+    def __seconds(self):
+        return self.__getClock().seconds()
+
+    def __timeoutWaiter(self, d, timeout):
+        self._removeWaiter(d)
+        d.errback(defer.TimeoutError("Lock not acquired after {0} seconds".format(timeout)))
+
+    @staticmethod
+    def __cancelTimeout(result, timeoutCall):
+        if timeoutCall.active():
+            timeoutCall.cancel()
+        return result
+
+    def _grantWaiter(self, waiter):
+        waiter.callback(None)
+        return True